@@ -1,15 +1,20 @@
-import seaborn as sns
-import pandas as pd
-import rospkg
 import os
 import traceback
-import numpy as np
 import argparse
-import matplotlib.pyplot as plt
+import hashlib
 import json
 import yaml
+from concurrent.futures import ThreadPoolExecutor
 
-from utils import Utils
+from utils import Utils, LazyModule
+from run_index import RunIndex
+from ragged import RaggedArray, register_accessor
+
+## Heavy packages are only imported once a plot is created
+sns = LazyModule("seaborn")
+pd = LazyModule("pandas")
+np = LazyModule("numpy")
+plt = LazyModule("matplotlib.pyplot")
 
 """
     TODO: 
@@ -27,21 +32,39 @@ aggregate_callbacks = {
 }
 
 DIST_PLOTS = {
-    "strip": sns.stripplot,
-    "swarm": sns.swarmplot,
-    "box": sns.boxplot,
-    "boxen": sns.boxenplot,
-    "violin": sns.violinplot
+    "strip": lambda **kwargs: sns.stripplot(**kwargs),
+    "swarm": lambda **kwargs: sns.swarmplot(**kwargs),
+    "box": lambda **kwargs: sns.boxplot(**kwargs),
+    "boxen": lambda **kwargs: sns.boxenplot(**kwargs),
+    "violin": lambda **kwargs: sns.violinplot(**kwargs)
 }
 
 CAT_PLOTS = {
-    "line": sns.lineplot,
-    "bar": sns.barplot
+    "line": lambda **kwargs: sns.lineplot(**kwargs),
+    "bar": lambda **kwargs: sns.barplot(**kwargs)
 }
 
 SHOULD_SAVE_PLOTS_KEY = "SHOULD_SAVE_PLOTS"
 SAVE_PLOTS_LOCATION = "SAVE_PLOTS_LOCATION"
 
+## Plots drawing a marker for every value, they are subsampled to the point budget
+POINT_PLOTS = ["strip", "swarm"]
+
+SAVE_FORMATS = ["pdf", "png", "svg"]
+
+## Overwritten by the rendering block of the declaration file
+DEFAULT_RENDER_SETTINGS = {
+    "point_budget": None,
+    "swarm_threshold": 2000,
+    "swarm_fallback": "strip",
+    "rasterize": False,
+    "format": "pdf",
+    "dpi": 200,
+    "seed": 0
+}
+
+RENDER_SETTINGS = dict(DEFAULT_RENDER_SETTINGS)
+
 def assert_dist_plot(key):
     assert key in DIST_PLOTS, f"Invalid plot {key} for distribution"
 
@@ -51,20 +74,226 @@ def assert_cat_plot(key):
 def assert_datakey_valid(key, valid_keys):
     assert key in valid_keys, f"Key {key} not valid"
 
+def set_render_settings(render_declaration):
+    RENDER_SETTINGS.clear()
+    RENDER_SETTINGS.update({**DEFAULT_RENDER_SETTINGS, **(render_declaration or {})})
+
+    assert RENDER_SETTINGS["format"] in SAVE_FORMATS, f"Invalid format {RENDER_SETTINGS['format']} for plots"
+    assert_dist_plot(RENDER_SETTINGS["swarm_fallback"])
+
+def subsample(data, x, budget):
+    """
+        Samples about budget values, every group of x keeps its share
+        of the values but at least one value
+    """
+    share = budget / len(data)
+
+    return pd.concat([
+        group.sample(n=min(len(group), max(1, round(len(group) * share))), random_state=RENDER_SETTINGS["seed"])
+        for _, group in data.groupby(x, observed=True)
+    ])
+
+def draw_distribution(plot_key, data, y, x, plot_args={}):
+    """
+        Draws a distributional plot. Plots drawing every value are subsampled 
+        to the point budget, every group of x keeps its share of the values. 
+        Swarm plots of more values than the swarm threshold fall back to
+        another plot, since placing the markers is superlinear.
+    """
+    assert_dist_plot(plot_key)
+
+    budget = RENDER_SETTINGS["point_budget"]
+
+    if plot_key in POINT_PLOTS and budget != None and len(data) > budget:
+        data = subsample(data, x, budget)
+
+    threshold = RENDER_SETTINGS["swarm_threshold"]
+
+    if plot_key == "swarm" and threshold != None and len(data) > threshold:
+        print("Drawing", len(data), "values as", RENDER_SETTINGS["swarm_fallback"], "instead of swarm plot")
+        plot_key = RENDER_SETTINGS["swarm_fallback"]
+
+    ## Swarm plots replace the draw method of their markers, which can only be rasterized from the start
+    if plot_key in POINT_PLOTS and RENDER_SETTINGS["rasterize"]:
+        plot_args = {"rasterized": True, **plot_args}
+
+    DIST_PLOTS[plot_key](data=data, y=y, x=x, **plot_args)
+
 def plot(title, save_name, show_legend=True):
     if show_legend:
         plt.legend()
 
     plt.title(title)
 
+    if RENDER_SETTINGS["rasterize"]:
+        ## Markers and areas are stored as an image, axes and text stay vector graphics
+        for ax in plt.gcf().axes:
+            for collection in ax.collections:
+                if not collection.get_rasterized():
+                    collection.set_rasterized(True)
+
     if os.environ.get(SHOULD_SAVE_PLOTS_KEY, "False") == "True":
         print("SAVING PLOT")
-        plt.savefig(os.path.join(os.environ.get(SAVE_PLOTS_LOCATION, "plots"), save_name + ".pdf"))
+        plt.savefig(
+            os.path.join(os.environ.get(SAVE_PLOTS_LOCATION, "plots"), save_name + "." + RENDER_SETTINGS["format"]),
+            dpi=RENDER_SETTINGS["dpi"]
+        )
     else:
         plt.show()
 
     plt.close()
 
+
+class PlotCache:
+    """
+        Remembers a fingerprint of every rendered entry of a declaration file
+        in its save location. The fingerprint covers the yaml of the entry,
+        the files of the used datasets and the plotting code. Entries whose 
+        fingerprint did not change and whose output files still exist are 
+        not rendered again.
+    """
+    FILE_NAME = ".plot_cache.json"
+
+    ## Declaration keys changing every entry
+    GLOBAL_KEYS = ["datasets", "dataset_filter", "region_filter", "rendering"]
+
+    ## Local modules the plots are created with
+    CODE_MODULES = ["create_plots.py", "utils.py", "ragged.py", "run_index.py"]
+
+    def __init__(self, location, declaration_file, dataset_names, force=False):
+        self.location = location
+        self.force = force
+
+        self.entries = {}
+        self.rebuilt = []
+        self.unchanged = []
+
+        if self.location == None:
+            return
+
+        self.file_name = os.path.join(location, PlotCache.FILE_NAME)
+
+        if os.path.exists(self.file_name):
+            with open(self.file_name) as file:
+                self.entries = json.load(file)
+
+        self.base_fingerprint = PlotCache.hash([
+            PlotCache.get_code_version(),
+            {key: declaration_file.get(key, None) for key in PlotCache.GLOBAL_KEYS},
+            [PlotCache.get_dataset_version(name) for name in dataset_names]
+        ])
+
+    @staticmethod
+    def hash(content):
+        return hashlib.sha1(json.dumps(content, sort_keys=True, default=str).encode()).hexdigest()
+
+    @staticmethod
+    def get_code_version():
+        versions = []
+
+        for module in PlotCache.CODE_MODULES:
+            with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), module), "rb") as file:
+                versions.append(hashlib.sha1(file.read()).hexdigest())
+
+        return versions
+
+    @staticmethod
+    def get_dataset_version(name):
+        version = [name]
+
+        for file_name in ["metrics.csv", "params.yaml"]:
+            path = os.path.join("data", name, file_name)
+
+            if os.path.exists(path):
+                stat = os.stat(path)
+                version.extend([stat.st_mtime_ns, stat.st_size])
+
+        return version
+
+    @staticmethod
+    def get_entry_id(key, index, entry):
+        return f"{key}:{entry.get('save_name', index)}"
+
+    def get_fingerprint(self, key, entry):
+        return PlotCache.hash([self.base_fingerprint, key, entry])
+
+    def is_cached(self, key, index, entry):
+        if self.location == None or self.force:
+            return False
+
+        cached = self.entries.get(PlotCache.get_entry_id(key, index, entry), None)
+
+        if cached == None or cached["fingerprint"] != self.get_fingerprint(key, entry):
+            return False
+
+        return len(cached["outputs"]) > 0 and all(
+            os.path.exists(os.path.join(self.location, output)) for output in cached["outputs"]
+        )
+
+    def has_stale_entries(self, entries):
+        return any(not self.is_cached(key, index, entry) for key, index, entry in entries)
+
+    def get_files(self):
+        return {
+            file.name: file.stat().st_mtime_ns
+            for file in os.scandir(self.location)
+            if file.is_file() and file.name != PlotCache.FILE_NAME
+        }
+
+    def render(self, key, index, entry, function, *args, **kwargs):
+        """
+            Calls the plot function unless the entry is cached. The files
+            created or changed by the function are the outputs of the entry.
+        """
+        entry_id = PlotCache.get_entry_id(key, index, entry)
+
+        if self.is_cached(key, index, entry):
+            self.unchanged.append(entry_id)
+            return
+
+        if self.location == None:
+            function(*args, **kwargs)
+            return
+
+        files_before = self.get_files()
+
+        function(*args, **kwargs)
+
+        self.entries[entry_id] = {
+            "fingerprint": self.get_fingerprint(key, entry),
+            "outputs": sorted([
+                name for name, mtime in self.get_files().items()
+                if files_before.get(name, None) != mtime
+            ])
+        }
+
+        self.rebuilt.append(entry_id)
+
+        ## Written after every entry, so a failing plot keeps the previous ones cached
+        self.save()
+
+    def save(self):
+        temporary_file = f"{self.file_name}.{os.getpid()}"
+
+        with open(temporary_file, "w") as file:
+            json.dump(self.entries, file, indent=2)
+
+        os.replace(temporary_file, self.file_name)
+
+    def report(self):
+        if self.location == None:
+            return
+
+        print("Rebuilt", len(self.rebuilt), "plots")
+
+        for entry_id in self.rebuilt:
+            print("    ", entry_id)
+
+        print("Unchanged", len(self.unchanged), "plots")
+
+        for entry_id in self.unchanged:
+            print("    ", entry_id)
+
 """
 
 METRIC FILE SCHEMA:
@@ -87,6 +316,14 @@ action_type             (MOVE | STOP | ROTATE)[]                # Action type of
 time_diff               INT                                     # Time the episode took, ros time in ns
 time                    INT[]                                   # Time of each step
 result                  TIMEOUT | GOAL_REACHED | COLLISION      # Wether an episode was successful or not
+<key>_<stat>            FLOAT                                   # Summary of velocity, acceleration, jerk, curvature and roughness
+                                                                # with stat in min, max, mean, std, p50, p95
+clearance_min           FLOAT                                   # Optional: Minimal distance to the static obstacles of the map
+clearance_mean          FLOAT                                   # Optional: Mean distance to the static obstacles of the map
+clearance_below_threshold_time INT                              # Optional: Time spent closer to the static obstacles than the threshold
+tracking_error_<type>_<stat> FLOAT                              # Summary of the linear and angular difference of cmd_vel and velocity
+actuation_lag           INT                                     # Delay of the velocity behind cmd_vel, same unit as time_diff
+action_share_<action>   FLOAT                                   # Share of the time spent in the action type, with action in move, stop, rotate
 
 """
 
@@ -94,50 +331,465 @@ result                  TIMEOUT | GOAL_REACHED | COLLISION      # Wether an epis
 # check if all metrics use the same map 
 # concatenate all files in big dataset
 
-def read_datasets(data_paths):
+METRICS_CONVERTERS = {
+    "path_length_values": Utils.string_to_float_list,
+    "curvature": Utils.string_to_float_list,
+    "roughness": Utils.string_to_float_list,
+    "velocity": Utils.string_to_float_list,
+    "jerk": Utils.string_to_float_list,
+    "start": Utils.string_to_float_list,
+    "goal": Utils.string_to_float_list,
+    "time": Utils.string_to_float_list,
+    "normalized_curvature": Utils.string_to_float_list,
+    "acceleration": lambda a: json.loads(a),
+    "path": lambda a: json.loads(a),
+    "action_type": lambda a: json.loads(a.replace("'", "\"")),
+}
+
+## Dtypes of the per step coloumns stored as ragged arrays, the time
+## needs double precision since it is stored in ns
+RAGGED_DTYPES = {
+    "curvature": "float32",
+    "normalized_curvature": "float32",
+    "roughness": "float32",
+    "path_length_values": "float32",
+    "acceleration": "float32",
+    "jerk": "float32",
+    "velocity": "float32",
+    "path": "float32",
+    "start": "float32",
+    "goal": "float32",
+    "time": "float64",
+    "action_type": None
+}
+
+## Coloumns no plot uses by default, they are only parsed if requested explicitly
+ON_DEMAND_COLOUMNS = [
+    "normalized_curvature",
+    "action_type"
+]
+
+## Metric coloumns stored as float32. Coloumns in ns, e.g. actuation_lag,
+## are missing here since float32 would round them to several microseconds
+FLOAT32_COLOUMNS = [
+    "path_length",
+    "angle_over_length",
+    "clearance_min",
+    "clearance_mean",
+    "action_share_move",
+    "action_share_stop",
+    "action_share_rotate",
+    *[
+        f"{key}_{stat}"
+        for key in ["curvature", "roughness", "acceleration", "jerk", "velocity", "tracking_error_linear", "tracking_error_angular"]
+        for stat in ["min", "max", "mean", "std", "p50", "p95"]
+    ]
+]
+
+## Coloumns with few distinct values, stored as categoricals
+LABEL_COLOUMNS = [
+    "result",
+    "local_planner",
+    "agent_name",
+    "model",
+    "namespace",
+    "run"
+]
+
+## Number of episodes parsed at once, before their per step values are compacted
+DATASET_CHUNK_SIZE = 32
+
+## Number of datasets read at the same time, reading is mostly waiting for the storage
+DATASET_JOBS = 4
+
+## Params every dataset needs to be differentiated in the plots
+REQUIRED_PARAMS = [
+    "local_planner",
+    "agent_name",
+    "model",
+    "namespace",
+    "scenario_file"
+]
+
+## Coloumns holding values for every time step of an episode
+ARRAY_COLOUMNS = [
+    "curvature",
+    "normalized_curvature",
+    "roughness",
+    "path_length_values",
+    "acceleration",
+    "jerk",
+    "velocity",
+    "cmd_vel",
+    "collisions",
+    "path",
+    "action_type",
+    "time",
+    "start",
+    "goal"
+]
+
+def get_required_coloumns(declaration_file, header):
+    """
+        Returns the coloumns of a metrics file which are needed for the declared plots.
+        The per step arrays are only read if a plot cannot use the summary coloumns.
+    """
+    required = set()
 
+    for line in declaration_file.get("single_episode_line", []):
+        required.update([line["data_key"], "time"])
+
+    for line in declaration_file.get("single_episode_distribution", []):
+        required.add(line["data_key"])
+
+    for line in declaration_file.get("aggregated_distribution", []) + declaration_file.get("aggregated_line", []):
+        if f"{line['data_key']}_{line['aggregate']}" not in header:
+            required.add(line["data_key"])
+
+    if declaration_file.get("episode_plots_for_namespaces", None) != None or declaration_file.get("create_best_plots", None) != None:
+        required.update(["path", "start", "goal"])
+
+    return [c for c in header if c not in ARRAY_COLOUMNS or c in required]
+
+def read_dataset(path, declaration_files=[]):
+    """
+        Reads the metrics of a single run with the coloumns required by
+        any of the declaration files. Returns the dataset and its scenario file
+    """
+    base_path = os.path.join("data", path)
+    metrics = os.path.join(base_path, "metrics.csv")
+    params = os.path.join(base_path, "params.yaml")
+
+    missing_files = get_missing_files(base_path)
+
+    if len(missing_files) > 0:
+        raise FileNotFoundError("missing " + ", ".join(missing_files))
+
+    with open(params) as file:
+        params_content = yaml.safe_load(file) or {}
+
+    missing_params = get_missing_params(params_content)
+
+    if len(missing_params) > 0:
+        raise ValueError("params.yaml is missing " + ", ".join(missing_params))
+
+    coloumns = None
+
+    if len(declaration_files) > 0:
+        header = pd.read_csv(metrics, nrows=0).columns
+        required = [set(get_required_coloumns(declaration_file, header)) for declaration_file in declaration_files]
+
+        coloumns = [c for c in header if any(c in r for r in required)]
+
+    dataset = read_compact_metrics(metrics, coloumns)
+
+    return add_params_coloumns(dataset, params_content, path), params_content["scenario_file"]
+
+
+def add_params_coloumns(dataset, params_content, run):
+    # Set parameters in dataset coloumns for better differentiation
+    dataset["local_planner"] = params_content["local_planner"]
+    dataset["agent_name"] = params_content["agent_name"]
+    dataset["model"] = params_content["model"]
+    dataset["namespace"] = params_content["namespace"]
+    dataset["run"] = run
+
+    return dataset
+
+
+def read_results(results):
+    """
+        Creates the dataset from metrics results held in memory, see
+        Metrics.from_arrays. Missing params are filled with the name of the result.
+    """
     datasets = []
-    scenarios = []
+    scenarios = {}
+
+    for result in results:
+        params_content = {
+            **{key: result.name for key in ["local_planner", "agent_name", "model", "namespace"]},
+            **result.params
+        }
+
+        dataset = compact_frame(result.metrics.reset_index())
+
+        datasets.append(add_params_coloumns(dataset, params_content, result.name))
+        scenarios[result.name] = params_content.get("scenario_file", None)
+
+    problems = get_scenario_problems(scenarios)
+
+    if len(problems) > 0:
+        raise ValueError(format_validation_report(problems))
+
+    return compact_labels(pd.concat(datasets)), next(iter(scenarios.values()))
+
+
+def read_compact_metrics(metrics, coloumns=None):
+    """
+        Reads the metrics in chunks. The per step numbers of every chunk are
+        parsed from their strings into ragged arrays, which are concatenated
+        into one buffer per coloumn at the end. Thus no python lists are created
+        for them. Scalar floats are stored as float32.
+    """
+    parsed = [
+        key for key in METRICS_CONVERTERS
+        if (coloumns == None and key not in ON_DEMAND_COLOUMNS) or (coloumns != None and key in coloumns)
+    ]
+
+    ## Coloumns of other values than numbers are converted to python lists first
+    converters = {key: METRICS_CONVERTERS[key] for key in parsed if RAGGED_DTYPES[key] == None}
+
+    chunks = []
+    ragged_chunks = {}
+    uncompacted = set()
+
+    for chunk in pd.read_csv(metrics, usecols=coloumns, converters=converters, chunksize=DATASET_CHUNK_SIZE):
+        for key in [c for c in chunk.columns if c in parsed and c not in uncompacted]:
+            try:
+                if key in converters:
+                    ragged_array = RaggedArray.from_sequences(chunk[key], RAGGED_DTYPES[key])
+                else:
+                    ragged_array = RaggedArray.from_strings(chunk[key], RAGGED_DTYPES[key])
+            except ValueError:
+                ## Values of other formats or shapes stay sequences, also in the chunks compacted before
+                uncompacted.add(key)
+
+                for previous, previous_ragged_array in zip(chunks, ragged_chunks.pop(key, [])):
+                    previous[key] = previous_ragged_array.to_series(previous.index, key)
+            else:
+                ragged_chunks.setdefault(key, []).append(ragged_array)
+                chunk[key] = None
+
+        for key in [c for c in chunk.columns if c in uncompacted and c not in converters]:
+            chunk[key] = chunk[key].map(METRICS_CONVERTERS[key])
+
+        chunks.append(chunk)
+
+    dataset = pd.concat(chunks)
 
-    for path in data_paths:
+    for key, ragged_arrays in ragged_chunks.items():
+        dataset[key] = RaggedArray.concatenate(ragged_arrays).to_series(dataset.index, key)
+
+    return to_float32(dataset)
+
+
+def compact_frame(dataset):
+    """
+        Moves the per step values of a DataFrame held in memory into ragged arrays
+    """
+    dataset = dataset.copy()
+
+    for key in [c for c in dataset.columns if c in RAGGED_DTYPES]:
+        try:
+            dataset[key] = RaggedArray.from_sequences(dataset[key], RAGGED_DTYPES[key]).to_series(dataset.index, key)
+        except ValueError:
+            continue
+
+    ## Metrics computed in memory have object coloumns
+    return to_float32(dataset.infer_objects())
+
+
+def to_float32(dataset):
+    for key in FLOAT32_COLOUMNS:
+        if key in dataset.columns and dataset[key].dtype == "float64":
+            dataset[key] = dataset[key].astype("float32")
+
+    return dataset
+
+
+def compact_labels(dataset):
+    for key in LABEL_COLOUMNS:
+        if key in dataset.columns:
+            dataset[key] = dataset[key].astype("category")
+
+    return dataset
+
+
+def get_missing_files(base_path):
+    return [f for f in ["metrics.csv", "params.yaml"] if not os.path.exists(os.path.join(base_path, f))]
+
+
+def get_missing_params(params_content):
+    return [key for key in REQUIRED_PARAMS if key not in params_content]
+
+
+def get_scenario_problems(scenarios):
+    """
+        Returns a problem for every dataset if the datasets used different
+        scenario files, since a comparison makes no sense then
+    """
+    if len(set(scenarios.values())) <= 1:
+        return {}
+
+    return {path: [f"uses scenario {scenario}"] for path, scenario in scenarios.items()}
+
+
+def validate_datasets(data_paths):
+    """
+        Checks the files and params of all datasets without reading the metrics.
+        Returns the problems of every dataset, datasets without problems are omitted.
+    """
+    problems = {}
+    scenarios = {}
+
+    for path in dict.fromkeys(data_paths):
         base_path = os.path.join("data", path)
-        metrics = os.path.join(base_path, "metrics.csv")
-        params = os.path.join(base_path, "params.yaml")
-
-        assert os.path.exists(
-            metrics
-        ) and os.path.exists(params), "Metrics or params file does not exist"
-
-        with open(params) as file:
-            params_content = yaml.safe_load(file)
-
-        scenarios.append(params_content["scenario_file"])
-
-        dataset = pd.read_csv(metrics, converters={
-            "path_length_values": Utils.string_to_float_list,
-            "curvature": Utils.string_to_float_list,
-            "roughness": Utils.string_to_float_list,
-            "velocity": Utils.string_to_float_list,
-            "jerk": Utils.string_to_float_list,
-            "start": Utils.string_to_float_list,
-            "goal": Utils.string_to_float_list,
-            "time": Utils.string_to_float_list,
-            "acceleration": lambda a: json.loads(a),
-            "path": lambda a: json.loads(a),
-        })
 
-        # Set parameters in dataset coloumns for better differentiation
-        dataset["local_planner"] = params_content["local_planner"]
-        dataset["agent_name"] = params_content["agent_name"]
-        dataset["model"] = params_content["model"]
-        dataset["namespace"] = params_content["namespace"]
+        missing = get_missing_files(base_path)
+
+        if len(missing) > 0:
+            problems[path] = ["missing " + ", ".join(missing)]
+            continue
+
+        try:
+            with open(os.path.join(base_path, "params.yaml")) as file:
+                params_content = yaml.safe_load(file) or {}
+        except yaml.YAMLError as e:
+            problems[path] = [f"params.yaml cannot be parsed: {e}"]
+            continue
+
+        missing_params = get_missing_params(params_content)
+
+        if len(missing_params) > 0:
+            problems[path] = ["params.yaml is missing " + ", ".join(missing_params)]
+            continue
+
+        scenarios[path] = params_content["scenario_file"]
+
+    for path, scenario_problems in get_scenario_problems(scenarios).items():
+        problems.setdefault(path, []).extend(scenario_problems)
+
+    return problems
+
+
+def format_validation_report(problems):
+    return "\n".join([
+        f"{len(problems)} datasets are invalid:",
+        *[f"    {path}: {'; '.join(dataset_problems)}" for path, dataset_problems in problems.items()]
+    ])
+
+
+class DatasetStore:
+    """
+        Reads every dataset at most once, thus several declaration files
+        over the same runs share the loaded data. Datasets are read 
+        concurrently by a bounded number of threads.
+    """
+    def __init__(self, declaration_files=[], jobs=DATASET_JOBS):
+        self.declaration_files = declaration_files
+        self.jobs = jobs
+        self.datasets = {}
+
+    def load(self, paths):
+        missing = [path for path in dict.fromkeys(paths) if path not in self.datasets]
+
+        if len(missing) <= 0:
+            return
+
+        ## Imported and registered once before the threads use them
+        register_accessor()
+
+        with ThreadPoolExecutor(max_workers=max(1, min(self.jobs, len(missing)))) as pool:
+            futures = {path: pool.submit(read_dataset, path, self.declaration_files) for path in missing}
+
+        errors = {}
+
+        for path, future in futures.items():
+            try:
+                self.datasets[path] = future.result()
+            except Exception as e:
+                errors[path] = e
+
+        ## All datasets which cannot be loaded are reported at once
+        if len(errors) > 0:
+            raise ValueError(format_validation_report({
+                path: [f"{type(error).__name__}: {error}"] for path, error in errors.items()
+            })) from next(iter(errors.values()))
+
+    def get(self, path):
+        self.load([path])
+
+        return self.datasets[path]
+
+
+def read_datasets(data_paths, declaration_file=None, store=None):
+    if store == None:
+        store = DatasetStore([] if declaration_file == None else [declaration_file])
+
+    store.load(data_paths)
+
+    ## Concatenated in the order of the declaration file, independent of the loading order
+    datasets, scenarios = zip(*[store.get(path) for path in data_paths])
+
+    problems = get_scenario_problems(dict(zip(data_paths, scenarios)))
+
+    if len(problems) > 0:
+        raise ValueError(format_validation_report(problems))
+
+    ## Categories are only created after concatenating, otherwise they would differ per dataset
+    return compact_labels(pd.concat(datasets)), scenarios[0]
+
+
+def get_dataset_names(declaration_file):
+    """
+        Returns the datasets listed in the declaration file or, if a 
+        dataset filter is given, all runs in the run index matching it
+    """
+    dataset_filter = declaration_file.get("dataset_filter", None)
 
-        datasets.append(dataset)
+    if dataset_filter == None:
+        return declaration_file["datasets"]
 
-    # If datasets used different scenario files a comparison makes no sense
-    assert len(set(scenarios)) == 1, "Scenario files are not the same"
+    index = RunIndex()
+    index.update()
 
-    return pd.concat(datasets), scenarios[0]
+    datasets = index.query_runs(dataset_filter)
+
+    index.close()
+
+    assert len(datasets) > 0, f"No datasets match the filter {dataset_filter}"
+
+    print("Datasets matching", dataset_filter, datasets)
+
+    return datasets
+
+
+def filter_episodes_by_region(dataset, declaration_file):
+    """
+        Keeps only the episodes passing through the region of the 
+        declaration file, or colliding in it if collisions_only is set
+    """
+    region_filter = declaration_file.get("region_filter", None)
+
+    if region_filter == None:
+        return dataset
+
+    index = RunIndex()
+    index.update()
+
+    episodes = index.query_episodes_in_region(
+        region_filter["x"][0],
+        region_filter["y"][0],
+        region_filter["x"][1],
+        region_filter["y"][1],
+        collisions_only=region_filter.get("collisions_only", False)
+    )
+
+    index.close()
+
+    selected = pd.MultiIndex.from_tuples(episodes, names=["run", "episode"]) if len(episodes) > 0 else []
+
+    dataset = dataset[pd.MultiIndex.from_frame(dataset[["run", "episode"]]).isin(selected)].copy()
+
+    ## Planners without episodes in the region are not shown
+    for key in LABEL_COLOUMNS:
+        dataset[key] = dataset[key].cat.remove_unused_categories()
+
+    assert len(dataset) > 0, f"No episodes match the region filter {region_filter}"
+
+    print("Episodes in region", region_filter, len(dataset))
+
+    return dataset
 
 
 ## FOR RESULT
@@ -166,6 +818,154 @@ class ResultPlotter:
             plot_args=result_declaration.get("plot_args", {}),    
         )
 
+## SUMMARY TABLE
+
+class SummaryTable:
+    """
+        Creates a table with the mean of the scalar episode values and their
+        bootstrap confidence intervals for every planner
+    """
+    POSSIBLE_VALUES = [
+        "result",
+        "time_diff",
+        "path_length",
+        "collision_amount",
+        "angle_over_length"
+    ]
+
+    FORMATS = ["csv", "md", "tex"]
+
+    ## Upper bound of the size of a single resample index matrix
+    MAX_BATCH_ELEMENTS = 10_000_000
+
+    @staticmethod
+    def bootstrap_mean(values, resamples, confidence, rng):
+        """
+            Calculates the confidence interval of the mean with the percentile bootstrap.
+            All resamples of a batch are drawn as one index matrix of shape
+            (resamples, len(values)) and averaged at once.
+        """
+        batch_size = max(1, SummaryTable.MAX_BATCH_ELEMENTS // len(values))
+
+        means = []
+
+        for start in range(0, resamples, batch_size):
+            indices = rng.integers(0, len(values), size=(min(batch_size, resamples - start), len(values)))
+
+            means.append(values[indices].mean(axis=1))
+
+        alpha = (1 - confidence) / 2
+
+        return np.quantile(np.concatenate(means), [alpha, 1 - alpha])
+
+    @staticmethod
+    def get_values(dataset, data_key):
+        if data_key == "result":
+            ## Success rate
+            return (dataset[data_key] == "GOAL_REACHED").to_numpy(dtype=float)
+
+        return dataset[data_key].to_numpy(dtype=float)
+
+    @staticmethod
+    def create_summary(dataset, data_keys, differentiate="local_planner", resamples=1000, confidence=0.95, seed=0):
+        for data_key in data_keys:
+            assert_datakey_valid(data_key, SummaryTable.POSSIBLE_VALUES)
+
+        rng = np.random.default_rng(seed)
+
+        rows = []
+
+        for name, group in dataset.groupby(differentiate, sort=True, observed=True):
+            row = {differentiate: name, "episodes": len(group)}
+
+            for data_key in data_keys:
+                values = SummaryTable.get_values(group, data_key)
+                values = values[~np.isnan(values)]
+
+                if len(values) <= 0:
+                    row[data_key + "_mean"], row[data_key + "_ci_low"], row[data_key + "_ci_high"] = np.nan, np.nan, np.nan
+                    continue
+
+                low, high = SummaryTable.bootstrap_mean(values, resamples, confidence, rng)
+
+                row[data_key + "_mean"] = values.mean()
+                row[data_key + "_ci_low"] = low
+                row[data_key + "_ci_high"] = high
+
+            rows.append(row)
+
+        return pd.DataFrame(rows).set_index(differentiate)
+
+    @staticmethod
+    def to_markdown(table, digits=3):
+        header = [table.index.name, *table.columns]
+        lines = [
+            "| " + " | ".join(header) + " |",
+            "| " + " | ".join(["---"] * len(header)) + " |"
+        ]
+
+        for name, row in zip(table.index, table.itertuples(index=False)):
+            lines.append("| " + " | ".join([str(name), *[SummaryTable.format_value(v, digits) for v in row]]) + " |")
+
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def to_latex(table, digits=3):
+        header = [table.index.name, *table.columns]
+        lines = [
+            "\\begin{tabular}{l" + "r" * len(table.columns) + "}",
+            "\\hline",
+            " & ".join([h.replace("_", "\\_") for h in header]) + " \\\\",
+            "\\hline"
+        ]
+
+        for name, row in zip(table.index, table.itertuples(index=False)):
+            lines.append(" & ".join([str(name).replace("_", "\\_"), *[SummaryTable.format_value(v, digits) for v in row]]) + " \\\\")
+
+        lines += ["\\hline", "\\end{tabular}"]
+
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def format_value(value, digits):
+        if isinstance(value, (int, np.integer)):
+            return str(value)
+
+        return f"{value:.{digits}f}"
+
+    @staticmethod
+    def create_summary_from_declaration(dataset, summary_declaration):
+        if summary_declaration == None:
+            return
+
+        table = SummaryTable.create_summary(
+            dataset,
+            summary_declaration.get("data_keys", SummaryTable.POSSIBLE_VALUES),
+            differentiate=summary_declaration.get("differentiate", "local_planner"),
+            resamples=summary_declaration.get("resamples", 1000),
+            confidence=summary_declaration.get("confidence", 0.95),
+            seed=summary_declaration.get("seed", 0)
+        )
+
+        digits = summary_declaration.get("digits", 3)
+
+        if os.environ.get(SHOULD_SAVE_PLOTS_KEY, "False") != "True":
+            print(SummaryTable.to_markdown(table, digits))
+            return
+
+        for format in summary_declaration.get("formats", SummaryTable.FORMATS):
+            assert format in SummaryTable.FORMATS, f"Invalid format {format} for summary"
+
+            file_name = os.path.join(os.environ.get(SAVE_PLOTS_LOCATION, "plots"), summary_declaration["save_name"] + "." + format)
+
+            if format == "csv":
+                table.to_csv(file_name)
+                continue
+
+            with open(file_name, "w") as file:
+                file.write(SummaryTable.to_markdown(table, digits) if format == "md" else SummaryTable.to_latex(table, digits))
+
+
 ## FOR TIME STEP VALUES -> ARRAYS FOR EACH EPISODE
 # curvature, normalized_curvature, roughness, path_length_value, acceleration, velocity
 
@@ -221,46 +1021,57 @@ class EpisodeArrayValuePlotter:
         """
         assert_datakey_valid(data_key, EpisodeArrayValuePlotter.POSSIBLE_DATA_KEYS)
 
-        assert_dist_plot(plot_key)
+        register_accessor()
 
-        local_data = dataset[dataset["episode"] == episode][[data_key, differentiate]].explode(data_key)
+        episode_data = dataset[dataset["episode"] == episode]
+        values = episode_data[data_key].ragged.array
+
+        local_data = pd.DataFrame({
+            data_key: values.buffer.astype(float),
+            differentiate: episode_data[differentiate].repeat(values.lengths).reset_index(drop=True)
+        })
 
-        DIST_PLOTS[plot_key](data=local_data, y=data_key, x=differentiate, **plot_args)
+        draw_distribution(plot_key, local_data, data_key, differentiate, plot_args)
 
         plot(title, save_name, False)
 
-    def distplot_for_aggregated(dataset, data_key, aggregate_callback, title, save_name, differentiate="namespace", plot_key="swarm", plot_args={}):
+    def distplot_for_aggregated(dataset, data_key, aggregate_callback, title, save_name, differentiate="namespace", plot_key="swarm", plot_args={}, aggregate=None):
         assert_datakey_valid(data_key, EpisodeArrayValuePlotter.POSSIBLE_DATA_KEYS)
-        assert_dist_plot(plot_key)
 
-        local_data = dataset[[data_key, differentiate]]
+        local_data = EpisodeArrayValuePlotter.get_aggregated_data(dataset, data_key, aggregate_callback, aggregate, [differentiate])
 
-        def aggregate_value(row):
-            row[data_key] = aggregate_callback(row[data_key])
+        draw_distribution(plot_key, local_data, data_key, differentiate, plot_args)
 
-            return row
+        plot(title, save_name)
+
+    def lineplot_for_aggregated(dataset, data_key, aggregate_callback, title, save_name, differentiate="namespace", plot_args={}, aggregate=None):
+        assert_datakey_valid(data_key, EpisodeArrayValuePlotter.POSSIBLE_DATA_KEYS)
 
-        local_data = local_data.apply(aggregate_value, axis=1)
+        local_data = EpisodeArrayValuePlotter.get_aggregated_data(dataset, data_key, aggregate_callback, aggregate, [differentiate, "episode"]).reset_index()
 
-        DIST_PLOTS[plot_key](data=local_data, y=data_key, x=differentiate, **plot_args)
+        sns.lineplot(data=local_data, x="episode", y=data_key, hue=differentiate, **plot_args)
 
         plot(title, save_name)
 
-    def lineplot_for_aggregated(dataset, data_key, aggregate_callback, title, save_name, differentiate="namespace", plot_args={}):
-        assert_datakey_valid(data_key, EpisodeArrayValuePlotter.POSSIBLE_DATA_KEYS)
+    def get_aggregated_data(dataset, data_key, aggregate_callback, aggregate, coloumns):
+        """
+            Aggregates the values of every episode. If the metrics contain the
+            precomputed summary coloumn for the aggregate, e.g. velocity_max,
+            it is used instead of the complete arrays.
+        """
+        summary_key = f"{data_key}_{aggregate}"
+
+        if aggregate != None and summary_key in dataset.columns:
+            return dataset[[summary_key, *coloumns]].rename(columns={summary_key: data_key})
 
-        local_data = dataset[[data_key, differentiate, "episode"]].reset_index()
+        local_data = dataset[[data_key, *coloumns]]
 
         def aggregate_value(row):
             row[data_key] = aggregate_callback(row[data_key])
 
             return row
 
-        local_data = local_data.apply(aggregate_value, axis=1)
-
-        sns.lineplot(data=local_data, x="episode", y=data_key, hue=differentiate, **plot_args)
-
-        plot(title, save_name)
+        return local_data.apply(aggregate_value, axis=1)
 
     def resize_time(row, key_reference, step_size):
         time_null = row["time"][0]
@@ -281,7 +1092,16 @@ class DiscreteValuePlotter:
         "time_diff",
         "angle_over_length",
         "collision_amount",
-        "path_length"
+        "path_length",
+        "clearance_min",
+        "clearance_mean",
+        "clearance_below_threshold_time",
+        "tracking_error_linear_mean",
+        "tracking_error_angular_mean",
+        "actuation_lag",
+        "action_share_move",
+        "action_share_stop",
+        "action_share_rotate"
     ]
 
     def catplot_over_episodes(dataset, data_key, title, save_name, differentiate="namespace", plot_key="line", plot_args={}):
@@ -294,9 +1114,8 @@ class DiscreteValuePlotter:
 
     def distplot_over_episodes(dataset, data_key, title, save_name, differentiate="namespace", plot_key="swarm", plot_args={}):
         assert_datakey_valid(data_key, DiscreteValuePlotter.POSSIBLE_VALUES)
-        assert_dist_plot(plot_key)
 
-        DIST_PLOTS[plot_key](data=dataset.reset_index(), y=data_key, x=differentiate, **plot_args)
+        draw_distribution(plot_key, dataset.reset_index(), data_key, differentiate, plot_args)
 
         plot(title, save_name, False)
 
@@ -416,6 +1235,8 @@ class PathVisualizer:
 
     @staticmethod
     def read_scenario_file(scenario):
+        import rospkg
+
         name = os.path.join(rospkg.RosPack().get_path("task_generator"), "scenarios", scenario)
 
         with open(name) as file:
@@ -425,6 +1246,8 @@ class PathVisualizer:
 
     @staticmethod
     def read_map_file(map_name):
+        import rospkg
+
         map_path = os.path.join(rospkg.RosPack().get_path("arena-simulation-setup"), "maps", map_name)
 
         with open(os.path.join(map_path, "map.yaml")) as file:
@@ -440,10 +1263,20 @@ class PathVisualizer:
         return new_coord
 
 
-def create_plots_from_declaration_file(declaration_file):
+def create_plots_from_declaration_file(declaration_file, force=False, store=None, metrics_results=None):
+    """
+        Creates the plots of the declaration file. Instead of the datasets
+        of the declaration file, metrics results held in memory can be 
+        plotted, then all plots are rendered.
+    """
     ## Show plots setup
 
     show_plots = declaration_file["show_plots"]
+    location = None
+
+    set_render_settings(declaration_file.get("rendering", None))
+
+    os.environ[SHOULD_SAVE_PLOTS_KEY] = "False"
 
     if not show_plots:
         os.environ[SHOULD_SAVE_PLOTS_KEY] = "True"
@@ -456,20 +1289,53 @@ def create_plots_from_declaration_file(declaration_file):
             traceback.print_exc()
             print("Path", location, "cannot be created")
 
+    if metrics_results != None:
+        if not isinstance(metrics_results, list):
+            metrics_results = [metrics_results]
+
+        ## Results in memory have no files to fingerprint
+        dataset_names = [result.name for result in metrics_results]
+        force = True
+    else:
+        dataset_names = get_dataset_names(declaration_file)
+
+    cache = PlotCache(location, declaration_file, dataset_names, force)
+
+    if not cache.has_stale_entries(get_declaration_entries(declaration_file)):
+        print("All plots are up to date")
+        return
+
     ## Dataset setup
 
-    dataset, scenario = read_datasets(declaration_file["datasets"])
+    if metrics_results != None:
+        dataset, scenario = read_results(metrics_results)
+    else:
+        dataset, scenario = read_datasets(dataset_names, declaration_file, store)
+
+    dataset = filter_episodes_by_region(dataset, declaration_file)
 
     ## Plot Result
 
-    ResultPlotter.plot_result_from_declaration(dataset, declaration_file.get("results", None))
+    results = declaration_file.get("results", None)
+
+    if results != None:
+        cache.render("results", 0, results, ResultPlotter.plot_result_from_declaration, dataset, results)
+
+    ## Summary table
+
+    summary = declaration_file.get("summary", None)
+
+    if summary != None:
+        cache.render("summary", 0, summary, SummaryTable.create_summary_from_declaration, dataset, summary)
     
     ## Plot time step values
 
     single_episode_line = declaration_file.get("single_episode_line", [])
 
-    for line in single_episode_line:
-        EpisodeArrayValuePlotter.lineplot_for_single_episode(
+    for index, line in enumerate(single_episode_line):
+        cache.render(
+            "single_episode_line", index, line,
+            EpisodeArrayValuePlotter.lineplot_for_single_episode,
             dataset, 
             line["data_key"],
             line["title"],
@@ -482,8 +1348,10 @@ def create_plots_from_declaration_file(declaration_file):
 
     single_episode_distribution = declaration_file.get("single_episode_distribution", [])
 
-    for line in single_episode_distribution:
-        EpisodeArrayValuePlotter.distplot_for_single_episode(
+    for index, line in enumerate(single_episode_distribution):
+        cache.render(
+            "single_episode_distribution", index, line,
+            EpisodeArrayValuePlotter.distplot_for_single_episode,
             dataset,
             line["data_key"],
             line["title"],
@@ -496,8 +1364,10 @@ def create_plots_from_declaration_file(declaration_file):
 
     aggregated_distribution = declaration_file.get("aggregated_distribution", [])
 
-    for line in aggregated_distribution:
-        EpisodeArrayValuePlotter.distplot_for_aggregated(
+    for index, line in enumerate(aggregated_distribution):
+        cache.render(
+            "aggregated_distribution", index, line,
+            EpisodeArrayValuePlotter.distplot_for_aggregated,
             dataset, 
             line["data_key"], 
             aggregate_callbacks[line["aggregate"]],
@@ -505,28 +1375,34 @@ def create_plots_from_declaration_file(declaration_file):
             line["save_name"],
             differentiate=line.get("differentiate", "namespace"),
             plot_key=line.get("plot_key", "swarm"),
-            plot_args=line.get("plot_args", {})
+            plot_args=line.get("plot_args", {}),
+            aggregate=line["aggregate"]
         )
 
     aggreagted_line = declaration_file.get("aggregated_line", [])
 
-    for line in aggreagted_line:
-        EpisodeArrayValuePlotter.lineplot_for_aggregated(
+    for index, line in enumerate(aggreagted_line):
+        cache.render(
+            "aggregated_line", index, line,
+            EpisodeArrayValuePlotter.lineplot_for_aggregated,
             dataset, 
             line["data_key"], 
             aggregate_callbacks[line["aggregate"]],
             line["title"],
             line["save_name"],
             differentiate=line.get("differentiate", "namespace"),
-            plot_args=line.get("plot_args", {})
+            plot_args=line.get("plot_args", {}),
+            aggregate=line["aggregate"]
         )
 
     # Plot episode values
 
     all_episodes_categorical = declaration_file.get("all_episodes_categorical", [])
 
-    for line in all_episodes_categorical:
-        DiscreteValuePlotter.catplot_over_episodes(
+    for index, line in enumerate(all_episodes_categorical):
+        cache.render(
+            "all_episodes_categorical", index, line,
+            DiscreteValuePlotter.catplot_over_episodes,
             dataset, 
             line["data_key"], 
             line["title"],
@@ -538,8 +1414,10 @@ def create_plots_from_declaration_file(declaration_file):
 
     all_episodes_distribution = declaration_file.get("all_episodes_distribution", [])
 
-    for line in all_episodes_distribution:
-        DiscreteValuePlotter.distplot_over_episodes(
+    for index, line in enumerate(all_episodes_distribution):
+        cache.render(
+            "all_episodes_distribution", index, line,
+            DiscreteValuePlotter.distplot_over_episodes,
             dataset, 
             line["data_key"], 
             line["title"],
@@ -556,7 +1434,9 @@ def create_plots_from_declaration_file(declaration_file):
     episode_plots_for_namespaces = declaration_file.get("episode_plots_for_namespaces", None)
 
     if episode_plots_for_namespaces != None:
-        path_visualizer.create_episode_plots_for_namespaces(
+        cache.render(
+            "episode_plots_for_namespaces", 0, episode_plots_for_namespaces,
+            path_visualizer.create_episode_plots_for_namespaces,
             dataset, 
             episode_plots_for_namespaces["title"],
             episode_plots_for_namespaces["save_name"],
@@ -569,7 +1449,9 @@ def create_plots_from_declaration_file(declaration_file):
     create_best_plots = declaration_file.get("create_best_plots", None)
 
     if create_best_plots != None:
-        path_visualizer.create_best_plots(
+        cache.render(
+            "create_best_plots", 0, create_best_plots,
+            path_visualizer.create_best_plots,
             dataset, 
             create_best_plots["title"],
             create_best_plots["save_name"],
@@ -577,11 +1459,105 @@ def create_plots_from_declaration_file(declaration_file):
             should_add_collisions=create_best_plots.get("should_add_collisions", False),
         )
 
+    cache.report()
+
+
+def create_plots_from_declaration_files(declaration_files, force=False, jobs=DATASET_JOBS):
+    """
+        Renders several declaration files, each into its own save location.
+        Datasets used by more than one declaration are only read once, with
+        the coloumns required by all of them.
+    """
+    store = DatasetStore(declaration_files, jobs)
+
+    for declaration_file in declaration_files:
+        create_plots_from_declaration_file(declaration_file, force, store)
+
+
+def read_declaration_files(paths):
+    """
+        Reads the declaration files in /plot_declarations. A directory
+        stands for all declaration files in it.
+    """
+    files = []
+
+    for path in paths:
+        path = os.path.join("plot_declarations", path)
+
+        if os.path.isdir(path):
+            files.extend(sorted(
+                os.path.join(path, name) for name in os.listdir(path)
+                if name.endswith(".yaml") or name.endswith(".yml")
+            ))
+        else:
+            files.append(path)
+
+    declaration_files = []
+
+    for file_name in files:
+        with open(file_name) as file:
+            declaration_files.append(yaml.safe_load(file))
+
+    return declaration_files
+
+
+PLOT_DECLARATION_KEYS = [
+    "results",
+    "summary",
+    "single_episode_line",
+    "single_episode_distribution",
+    "aggregated_distribution",
+    "aggregated_line",
+    "all_episodes_categorical",
+    "all_episodes_distribution",
+    "episode_plots_for_namespaces",
+    "create_best_plots"
+]
+
+
+def get_declaration_entries(declaration_file):
+    """
+        Returns the key, index and content of every plot entry in the declaration file
+    """
+    entries = []
+
+    for key in PLOT_DECLARATION_KEYS:
+        content = declaration_file.get(key, None)
+
+        if content == None:
+            continue
+
+        if not isinstance(content, list):
+            content = [content]
+
+        entries.extend([(key, index, entry) for index, entry in enumerate(content)])
+
+    return entries
+
+
+def dry_run_declaration_file(declaration_file):
+    """
+        Checks the datasets of the declaration file and lists the plots 
+        which would be created without loading any data
+    """
+    datasets = get_dataset_names(declaration_file)
+
+    problems = validate_datasets(datasets)
+
+    for path in datasets:
+        print("Dataset", path, "; ".join(problems[path]) if path in problems else "ok")
+
+    for key, _, entry in get_declaration_entries(declaration_file):
+        print(key, entry.get("save_name", ""), entry.get("data_key", ""))
+
 
 def parse_args():
     parser = argparse.ArgumentParser()
 
-    parser.add_argument("declaration_file")
+    parser.add_argument("declaration_files", nargs="+", help="Declaration files or directories of them in /plot_declarations")
+    parser.add_argument("--dry-run", action="store_true", help="Only check the datasets and list the plots")
+    parser.add_argument("--force", action="store_true", help="Render all plots, even if they did not change")
+    parser.add_argument("--jobs", "-j", type=int, default=DATASET_JOBS, help="Number of datasets read at the same time")
 
     return parser.parse_args()
 
@@ -589,7 +1565,10 @@ def parse_args():
 if __name__ == "__main__":
     args = parse_args()
 
-    with open(os.path.join("plot_declarations", args.declaration_file)) as file:
-        declaration_file = yaml.safe_load(file)
+    declaration_files = read_declaration_files(args.declaration_files)
 
-    create_plots_from_declaration_file(declaration_file)
\ No newline at end of file
+    if args.dry_run:
+        for declaration_file in declaration_files:
+            dry_run_declaration_file(declaration_file)
+    else:
+        create_plots_from_declaration_files(declaration_files, args.force, args.jobs)
\ No newline at end of file
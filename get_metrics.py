@@ -5,21 +5,48 @@ This file is used to calculate from the simulation data, various metrics, such a
 - how long did the robot take form start to goal
 the metrics / evaluation data will be saved to be preproccesed in the next step
 """
-import numpy as np
-import pandas as pd
 import os
+import io
+import csv
 import yaml
 import argparse 
-import rospkg
 import json
+import multiprocessing
+from time import sleep
 
-from utils import Utils
+from utils import Utils, LazyModule
+from map_clearance import MapClearance
+from scan_store import ScanStore
+from work_queue import WorkQueue
+
+np = LazyModule("numpy")
+pd = LazyModule("pandas")
 
 
 def parse_args():
     parser = argparse.ArgumentParser()
 
     parser.add_argument("--dir", "-d")
+    parser.add_argument("--stream", action="store_true", help="Read the recordings in chunks and analyze one episode at a time")
+    parser.add_argument("--chunk-size", type=int, default=5000, help="Number of rows read at once in stream mode")
+    parser.add_argument("--tolerance", type=float, default=None, help="Maximum age in ms of a topic message joined to a recorded step")
+    parser.add_argument("--robot-radius", type=float, default=None, help="Robot radius used instead of the model params")
+    parser.add_argument("--robot-params", default=None, help="Path of a model_params.yaml used instead of the one of the recorded model")
+    parser.add_argument("--watch", action="store_true", help="Analyze every finished episode while the recorder is still writing")
+    parser.add_argument("--clearance", action="store_true", help="Calculate the clearance to the static obstacles of the map")
+    parser.add_argument("--map", default=None, help="Path of the map.yaml used instead of the map of the run")
+    parser.add_argument("--clearance-threshold", type=float, default=None, help="Clearance in m below which the time is summed up")
+    parser.add_argument("--jobs", "-j", type=int, default=1, help="Number of processes analyzing episodes in parallel")
+    parser.add_argument("--episode", type=int, default=None, help="Only analyze this episode again and replace it in the metrics file")
+    parser.add_argument("--poll-interval", type=float, default=2, help="Seconds between two reads of the recordings in watch mode")
+    parser.add_argument("--scan-store", action="store_true", help="Read the scans from a memory mapped matrix built once from scan.csv")
+    parser.add_argument("--scan-dtype", choices=["float32", "uint16"], default="float32", help="Dtype of the ranges in the scan store, uint16 stores mm")
+    parser.add_argument("--worker", action="store_true", help="Claim and analyze unprocessed runs in --data-dir until none are left")
+    parser.add_argument("--data-dir", default="data", help="Directory of the runs processed in worker mode")
+    parser.add_argument("--lock-timeout", type=float, default=300, help="Seconds after which the lock of a crashed worker expires")
+    parser.add_argument("--heartbeat", type=float, default=30, help="Seconds between two refreshes of the lock of a worker")
+    parser.add_argument("--retry-failed", action="store_true", help="Also claim runs whose analysis failed before in worker mode")
+    parser.add_argument("--include-unmarked", action="store_true", help="Also claim runs without done.yaml in worker mode, once their files did not change for the lock timeout")
 
     return parser.parse_args()
 
@@ -39,53 +66,598 @@ class DoneReason:
 class Config:
     TIMEOUT_TRESHOLD = 180e9
     MAX_COLLISIONS = 3
+    SUMMARY_STATS = ["min", "max", "mean", "std", "p50", "p95"]
+    CLEARANCE_THRESHOLD = 0.5
+    ## Upper bound of the actuation lag in steps searched by the cross correlation
+    MAX_LAG_STEPS = 50
+
+
+class StreamCursor:
+    """
+    Buffers the chunks of a single recorded topic for the 
+    timestamp aligned join in stream mode.
+    """
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.buffer = None
+
+    def read_until(self, time):
+        """
+        Returns all buffered rows recorded up to the given time. The last of
+        these rows is kept, because it is still the match for the following steps.
+        """
+        while self.buffer is None or len(self.buffer) <= 0 or self.buffer["time"].iloc[-1] < time:
+            chunk = next(self.chunks, None)
 
+            if chunk is None:
+                break
+
+            self.buffer = chunk if self.buffer is None else pd.concat([self.buffer, chunk])
+
+        rows = self.buffer[self.buffer["time"] <= time]
+
+        if len(rows) > 0:
+            self.buffer = self.buffer[self.buffer["time"] >= rows["time"].iloc[-1]]
+
+        return rows
+
+
+## Set before the worker processes are forked, thus the workers share
+## the recordings with the parent and only receive episode indices
+shared_state = {}
+
+
+def analyze_shared_episode(task):
+    index, positions = task
+
+    return shared_state["metrics"].analyze_episode(shared_state["data"].iloc[positions], index)
+
+
+def analyze_shared_segment(task):
+    index, directory = task
+
+    return shared_state["metrics"].analyze_segment(index, directory)
 
-class Metrics:
-    def __init__(self, dir):
-        self.dir = dir
 
-        self.robot_params = Metrics.get_robot_params(self.dir)
+class FileTail:
+    """
+    Reads the rows appended to a growing csv file. Only the bytes 
+    written since the last read are parsed, incomplete lines are
+    left for the next read.
+    """
+    def __init__(self, path, converters):
+        self.path = path
+        self.converters = converters
+        self.offset = 0
+        self.header = None
 
-        episode = pd.read_csv(self.dir + "/episode.csv", converters={
+    def read_new_rows(self):
+        if not os.path.exists(self.path):
+            return None
+
+        with open(self.path, "rb") as file:
+            file.seek(self.offset)
+            content = file.read()
+
+        end = content.rfind(b"\n") + 1
+
+        if end <= 0:
+            return None
+
+        self.offset += end
+
+        lines = content[:end].decode()
+
+        if self.header == None:
+            header, _, lines = lines.partition("\n")
+            self.header = next(csv.reader([header]))
+
+        if len(lines) <= 0:
+            return None
+
+        return pd.read_csv(
+            io.StringIO(lines), 
+            header=None, 
+            names=self.header, 
+            converters=self.converters, 
+            dtype={"time": "float64"}
+        )
+
+
+class MetricsResult:
+    """
+    Metrics of all episodes of a run in the format of metrics.csv,
+    together with the params of the run
+    """
+    def __init__(self, metrics, params, name):
+        self.metrics = metrics
+        self.params = params
+        self.name = name
+
+
+class Metrics:
+    ## Recorded files and the converters for their coloumns
+    RECORDINGS = {
+        "episode": {
             "data": lambda val: 0 if len(val) <= 0 else int(val) 
-        })
-        laserscan = pd.read_csv(self.dir + "/scan.csv", converters={
+        },
+        "scan": {
             "data": Utils.string_to_float_list
-        })
-        odom = pd.read_csv(self.dir + "/odom.csv", converters={
+        },
+        "odom": {
             "data": lambda col: json.loads(col.replace("'", "\""))
-        })
-        cmd_vel = pd.read_csv(self.dir + "/cmd_vel.csv", converters={
+        },
+        "cmd_vel": {
             "data": Utils.string_to_float_list
-        })
-        start_goal = pd.read_csv(self.dir + "/start_goal.csv", converters={
+        },
+        "start_goal": {
             "start": Utils.string_to_float_list,
             "goal": Utils.string_to_float_list
+        }
+    }
+
+    def __init__(self, dir, stream=False, chunk_size=5000, tolerance=None, robot_params=None, watch=False, poll_interval=2, episode=None, jobs=1, clearance=False, map_file=None, clearance_threshold=None, data=None, params=None, scan_store=False, scan_dtype="float32"):
+        self.dir = dir
+        self.jobs = jobs
+
+        ## Opened when the recordings are read, before any worker is forked
+        self.use_scan_store = scan_store
+        self.scan_dtype = scan_dtype
+        self.scan_store = None
+
+        ## Recorder time to ms conversion is done by dividing by 1e6
+        self.tolerance = None if tolerance is None else tolerance * 1e6
+
+        assert dir != None or robot_params != None, "Robot params are required without a recording directory"
+
+        self.robot_params = robot_params or Metrics.get_robot_params(self.dir)
+
+        ## Set by the modes analyzing all episodes at once
+        self.result = None
+
+        ## The distance transform of the map is loaded once, before any worker is forked
+        self.map_clearance = None
+        self.clearance_threshold = clearance_threshold or Config.CLEARANCE_THRESHOLD
+
+        if clearance:
+            self.map_clearance = MapClearance.get(map_file or Metrics.get_map_file(self.dir))
+
+        ## Steps joined in memory are analyzed without reading or writing any file
+        if data is not None:
+            self.result = self.analyze_data(data, params or {}, "memory")
+            return
+
+        is_segmented = os.path.exists(os.path.join(self.dir, "episode_index.csv"))
+
+        if watch:
+            assert not is_segmented, "Watch mode does not support recordings segmented by episode"
+
+            self.watch_episodes(poll_interval)
+            return
+
+        if is_segmented:
+            self.write_segmented_episodes(episode)
+            return
+
+        if episode != None:
+            self.write_single_episode(episode)
+            return
+
+        if stream:
+            self.write_episodes_streamed(chunk_size)
+            return
+
+        data = Metrics.join_recordings(*self.read_recordings(), tolerance=self.tolerance)
+
+        self.result = self.analyze_data(data, Metrics.read_params(self.dir), os.path.basename(os.path.normpath(self.dir)))
+        self.result.metrics.to_csv(os.path.join(dir, "metrics.csv"))
+
+    @staticmethod
+    def from_arrays(time, episode, scans, positions, velocities, cmd_vel, start, goal, robot_params, params={}, name="memory", jobs=1, map_file=None, clearance_threshold=None):
+        """
+        Calculates the metrics of steps held in memory, e.g. of a simulation
+        in a notebook or a test. All arguments except the params have one
+        entry per step:
+            time: ros time in ns
+            episode: index of the episode
+            scans: laser scan ranges
+            positions, velocities: x, y and yaw of the odometry
+            cmd_vel: commanded velocity
+            start, goal: position of the start and the goal of the episode
+
+        Returns a MetricsResult with the given name, which can be passed to create_plots
+        """
+        data = pd.DataFrame({
+            "time": np.asarray(time, dtype="float64"),
+            "episode": np.asarray(episode, dtype=int),
+            "laserscan": [np.asarray(scan, dtype=float) for scan in scans],
+            "odom": [
+                {"position": list(position), "velocity": list(velocity)}
+                for position, velocity in zip(positions, velocities)
+            ],
+            "cmd_vel": [np.asarray(values, dtype=float) for values in cmd_vel],
+            "start": [np.asarray(values, dtype=float) for values in start],
+            "goal": [np.asarray(values, dtype=float) for values in goal]
         })
 
+        result = Metrics(
+            None,
+            robot_params=robot_params,
+            jobs=jobs,
+            clearance=map_file != None,
+            map_file=map_file,
+            clearance_threshold=clearance_threshold,
+            data=data,
+            params=params
+        ).result
+
+        result.name = name
+
+        return result
+
+    def analyze_data(self, data, params, name):
+        ## Row positions of every episode
+        episode_positions = data.groupby("episode").indices
+
+        i = 0
+
+        tasks = []
+
+        while len(episode_positions.get(i, [])) > 5:
+            tasks.append((i, episode_positions[i]))
+            i = i + 1
+
+        results = self.map_episodes(analyze_shared_episode, tasks, data)
+
+        episode_data = {index: result for (index, _), result in zip(tasks, results)}
+
+        return MetricsResult(pd.DataFrame(episode_data).transpose().set_index("episode"), params, name)
+
+    def map_episodes(self, function, tasks, data=None):
+        """
+        Applies the function to all tasks, in parallel if more than one job is set.
+        The workers are forked after the recordings are stored in the shared state,
+        thus no DataFrame is pickled. The results keep the order of the tasks.
+        """
+        shared_state["metrics"] = self
+        shared_state["data"] = data
+
+        try:
+            if self.jobs <= 1 or len(tasks) <= 1:
+                return list(map(function, tasks))
+
+            with multiprocessing.get_context("fork").Pool(min(self.jobs, len(tasks))) as pool:
+                return pool.map(function, tasks, chunksize=1)
+        finally:
+            shared_state.clear()
+
+    def read_recordings(self, chunksize=None, dir=None):
+        """
+        Reads the recorded csv files. If a chunksize is given, 
+        iterators over chunks of the files are returned instead of
+        complete DataFrames.
+        """
+        dir = dir or self.dir
+
+        ## Only complete recordings of the run directory are read from the scan store
+        use_scan_store = self.use_scan_store and chunksize == None and dir == self.dir
+
+        if use_scan_store:
+            self.scan_store = ScanStore.get(self.dir, self.scan_dtype)
+
+        ## Older recordings have no time coloumn in the start goal file
+        return [
+            self.scan_store.get_index_frame() if name == "scan" and use_scan_store else pd.read_csv(
+                os.path.join(dir, name + ".csv"), 
+                converters=converters, 
+                dtype={"time": "float64"}, 
+                chunksize=chunksize
+            )
+            for name, converters in Metrics.RECORDINGS.items()
+        ]
+
+    @staticmethod
+    def join_recordings(episode, laserscan, odom, cmd_vel, start_goal, tolerance=None):
+        """
+        Joins the recorded topics onto the steps in the episode file. Every step 
+        gets the latest message of each topic recorded at or before its time, thus
+        the topics can be recorded with independent rates or only on change and 
+        the complete step series is reconstructed. Steps without an odometry message 
+        not older than the tolerance are dropped, missing scans and actions are empty.
+        Scans read from the scan store are joined as their row in the store.
+        """
         laserscan = laserscan.rename(columns={"data": "laserscan"})
         odom = odom.rename(columns={"data": "odom"})
         cmd_vel = cmd_vel.rename(columns={"data": "cmd_vel"})
 
-        data = pd.concat([episode, laserscan, odom, cmd_vel, start_goal], axis=1, join="inner")
-        data = data.loc[:,~data.columns.duplicated()].copy()
+        start_goal = start_goal.drop(columns="episode")
 
-        i = 0
+        if "time" in start_goal.columns:
+            data = pd.merge(episode, start_goal, on="time", how="inner")
+        else:
+            data = pd.concat([episode, start_goal], axis=1, join="inner")
+
+        data = data.sort_values("time", kind="stable")
+
+        for topic in [laserscan, odom, cmd_vel]:
+            data = pd.merge_asof(
+                data, 
+                topic.sort_values("time", kind="stable"), 
+                on="time", 
+                direction="backward", 
+                tolerance=tolerance
+            )
+
+        ## The recorder skips topics which did not publish yet
+        for key in [k for k in ["laserscan", "cmd_vel"] if k in data.columns]:
+            data[key] = [np.array([]) if isinstance(value, float) else value for value in data[key]]
+
+        return data.dropna(subset=["odom"])
+
+    def stream_recordings(self, chunk_size):
+        """
+        Reads the episode file chunk by chunk and joins the rows
+        of the topics recorded in the same time span onto each chunk.
+        """
+        episode, laserscan, odom, cmd_vel, start_goal = self.read_recordings(chunksize=chunk_size)
+
+        topics = [StreamCursor(laserscan), StreamCursor(odom), StreamCursor(cmd_vel)]
+
+        has_start_goal_time = "time" in pd.read_csv(self.dir + "/start_goal.csv", nrows=0).columns
+
+        if has_start_goal_time:
+            start_goal = StreamCursor(start_goal)
+
+        for chunk in episode:
+            if len(chunk) <= 0:
+                continue
+
+            last_time = chunk["time"].iloc[-1]
+
+            start_goal_chunk = start_goal.read_until(last_time) if has_start_goal_time else next(start_goal)
+
+            yield Metrics.join_recordings(
+                chunk, 
+                *[topic.read_until(last_time) for topic in topics], 
+                start_goal_chunk,
+                tolerance=self.tolerance
+            )
+
+    def stream_episodes(self, chunk_size):
+        """
+        Reads the recordings chunk by chunk and yields one episode at a time.
+        Only the rows of the current episode and a single chunk are held in memory.
+        The recorder writes the episodes consecutively, thus an episode is complete 
+        as soon as a row with a different episode index is read.
+        """
+        pending = []
+
+        for data in self.stream_recordings(chunk_size):
+            runs = (data["episode"] != data["episode"].shift()).cumsum()
+
+            for _, run in data.groupby(runs, sort=False):
+                if len(pending) > 0 and pending[0]["episode"].iloc[0] != run["episode"].iloc[0]:
+                    yield pd.concat(pending)
+
+                    pending = []
+
+                pending.append(run)
+
+        if len(pending) > 0:
+            yield pd.concat(pending)
+
+    def write_segmented_episodes(self, selected_episode=None):
+        """
+        Analyzes recordings with an own directory for every episode. Each episode
+        is read on its own, thus a single episode can be analyzed again cheaply.
+        """
+        index = pd.read_csv(os.path.join(self.dir, "episode_index.csv"))
+
+        if selected_episode != None:
+            index = index[index["episode"] == selected_episode]
+
+            assert len(index) > 0, f"Episode {selected_episode} is not recorded"
+
+        tasks = list(zip(index["episode"], index["directory"]))
+
+        results = self.map_episodes(analyze_shared_segment, tasks)
+
+        episode_data = {
+            episode: result for (episode, _), result in zip(tasks, results) 
+            if result != None
+        }
+
+        metrics_file = os.path.join(self.dir, "metrics.csv")
+
+        if selected_episode != None:
+            for data in episode_data.values():
+                Metrics.replace_metrics(metrics_file, data)
+            return
+
+        pd.DataFrame(episode_data).transpose().set_index("episode").to_csv(metrics_file)
+
+    def analyze_segment(self, episode, directory):
+        data = Metrics.join_recordings(
+            *self.read_recordings(dir=os.path.join(self.dir, directory)), 
+            tolerance=self.tolerance
+        )
+
+        if len(data) <= 5:
+            print("Skipping episode", episode, "with", len(data), "steps")
+            return None
+
+        return self.analyze_episode(data, episode)
+
+    def write_single_episode(self, selected_episode):
+        data = Metrics.join_recordings(*self.read_recordings(), tolerance=self.tolerance)
+
+        current_episode = data[data["episode"] == selected_episode]
+
+        assert len(current_episode) > 5, f"Episode {selected_episode} is not recorded"
+
+        Metrics.replace_metrics(os.path.join(self.dir, "metrics.csv"), self.analyze_episode(current_episode, selected_episode))
+
+    @staticmethod
+    def replace_metrics(metrics_file, episode_data):
+        """
+        Replaces the row of a single episode in the metrics file. The
+        other rows are written back as they were read.
+        """
+        row = pd.DataFrame([episode_data]).set_index("episode")
+
+        if os.path.exists(metrics_file):
+            metrics = pd.read_csv(metrics_file, index_col="episode", dtype=str)
+            metrics.index = metrics.index.astype(int)
+
+            row.index = row.index.astype(int)
 
-        episode_data = {}
+            ## Only episodes analyzed before have a row to replace
+            row = pd.concat([metrics.drop(index=[i for i in row.index if i in metrics.index]), row.astype(str)])
 
-        while True:
-            current_episode = data[data["episode"] == i]
+            assert row.index.is_unique, f"Metrics file {metrics_file} contains duplicate episodes"
 
-            if len(current_episode) <= 5:
+        row.sort_index().to_csv(metrics_file)
+
+    def write_episodes_streamed(self, chunk_size):
+        """
+        Analyzes the episodes one by one and appends each result 
+        directly to the metrics file.
+        """
+        metrics_file = os.path.join(self.dir, "metrics.csv")
+
+        i = 0
+
+        for current_episode in self.stream_episodes(chunk_size):
+            if current_episode["episode"].iloc[0] != i or len(current_episode) <= 5:
                 break
-            
-            episode_data[i] = self.analyze_episode(current_episode, i)
+
+            Metrics.append_metrics(metrics_file, self.analyze_episode(current_episode, i), header=i == 0)
+
             i = i + 1
 
-        data = pd.DataFrame(episode_data).transpose().set_index("episode")
-        data.to_csv(os.path.join(dir, "metrics.csv"))
+    def watch_episodes(self, poll_interval):
+        """
+        Tails the recorded files and analyzes every episode exactly once as soon
+        as it is finished. An episode is finished when the episode file contains
+        a row of the following episode. Once the recorder wrote its done.yaml, the
+        last episode is analyzed and the watcher returns.
+        Episodes already contained in the metrics file are skipped.
+        """
+        metrics_file = os.path.join(self.dir, "metrics.csv")
+
+        analyzed = set()
+
+        if os.path.exists(metrics_file):
+            analyzed = set(pd.read_csv(metrics_file, usecols=["episode"])["episode"].tolist())
+
+        tails = {
+            name: FileTail(os.path.join(self.dir, name + ".csv"), converters) 
+            for name, converters in Metrics.RECORDINGS.items()
+        }
+        buffers = {name: None for name in tails}
+
+        ## Topics which did not publish yet have no rows
+        for name in ["scan", "odom", "cmd_vel"]:
+            buffers[name] = pd.DataFrame({"time": pd.Series(dtype="float64"), "data": pd.Series(dtype=object)})
+        results = []
+
+        print("Watching", self.dir)
+
+        try:
+            while True:
+                ## The recorder closes all files before writing done.yaml, thus
+                ## the rows read afterwards are the complete recording
+                is_done = os.path.exists(os.path.join(self.dir, "done.yaml"))
+
+                for name, tail in tails.items():
+                    rows = tail.read_new_rows()
+
+                    if rows is None:
+                        continue
+
+                    buffers[name] = rows if buffers[name] is None else pd.concat([buffers[name], rows], ignore_index=True)
+
+                while self.analyze_watched_episode(buffers, analyzed, metrics_file, results, is_done):
+                    pass
+
+                if is_done:
+                    print("Recording finished")
+                    return
+
+                sleep(poll_interval)
+        except KeyboardInterrupt:
+            pass
+
+    def analyze_watched_episode(self, buffers, analyzed, metrics_file, results, is_done=False):
+        """
+        Analyzes the first buffered episode if it is finished and removes
+        its rows from the buffers. If the recording is done, the last 
+        episode is finished as well. Returns whether an episode was finished.
+        """
+        if any([buffers[name] is None or len(buffers[name]) <= 0 for name in ["episode", "start_goal"]]):
+            return False
+
+        assert "time" in buffers["start_goal"].columns, "Watch mode needs a start goal file with a time coloumn"
+
+        episodes = buffers["episode"]
+        index = episodes["episode"].iloc[0]
+
+        is_later_episode = (episodes["episode"] != index).to_numpy()
+
+        if is_later_episode.any():
+            end = is_later_episode.argmax()
+        elif is_done:
+            end = len(episodes)
+        else:
+            return False
+
+        last_time = episodes["time"].iloc[end - 1]
+
+        ## The recorder flushes all files when an episode changes. Topics recorded 
+        ## on change may have no newer rows, thus only the start goal file, which is
+        ## written in every step, is checked. A topic flushed later than the start goal
+        ## file may still miss its last rows, they are joined from the previous message.
+        if not is_done and buffers["start_goal"]["time"].iloc[-1] < last_time:
+            return False
+
+        data = Metrics.join_recordings(
+            episodes.iloc[:end], 
+            *[buffers[name] for name in ["scan", "odom", "cmd_vel", "start_goal"]],
+            tolerance=self.tolerance
+        )
+
+        if index not in analyzed and len(data) > 5:
+            episode_data = self.analyze_episode(data, index)
+
+            Metrics.append_metrics(metrics_file, episode_data, header=not os.path.exists(metrics_file))
+
+            results.append(episode_data["result"])
+
+            print(
+                "Episode", index, episode_data["result"], 
+                "success rate", round(results.count(DoneReason.GOAL_REACHED) / len(results), 3)
+            )
+
+        analyzed.add(index)
+
+        buffers["episode"] = episodes.iloc[end:]
+        buffers["start_goal"] = buffers["start_goal"][buffers["start_goal"]["time"] > last_time]
+
+        ## Keep the last message of every topic, it is still the match for the next steps
+        for name in ["scan", "odom", "cmd_vel"]:
+            buffer = buffers[name]
+
+            buffers[name] = buffer.iloc[max((buffer["time"] <= last_time).sum() - 1, 0):]
+
+        return True
+
+    @staticmethod
+    def append_metrics(metrics_file, episode_data, header):
+        pd.DataFrame([episode_data]).set_index("episode").to_csv(
+            metrics_file, 
+            mode="w" if header else "a", 
+            header=header
+        )
 
     def analyze_episode(self, episode, index):
         positions, velocities = [], []
@@ -101,34 +673,49 @@ class Metrics:
         acceleration = self.get_acceleration(vel_absolute)
         jerk = self.get_jerk(vel_absolute)
 
-        collisions, collision_amount = self.get_collisions(
-            episode["laserscan"],
-            self.robot_params["robot_radius"]
-        )
+        if "scan_row" in episode.columns:
+            collisions, collision_amount = Metrics.count_collisions(
+                self.scan_store.get_collision_markers(episode["scan_row"], self.robot_params["robot_radius"])
+            )
+        else:
+            collisions, collision_amount = self.get_collisions(
+                episode["laserscan"],
+                self.robot_params["robot_radius"]
+            )
 
         path_length, path_length_per_step = self.get_path_length(positions)
 
         time = int(list(episode["time"])[-1] - list(episode["time"])[0])
 
+        action_type = self.get_action_type(episode["cmd_vel"])
+
         start_position = self.get_mean_position(episode, "start")
         goal_position = self.get_mean_position(episode, "goal")
 
         print("PATH LENGTH", path_length, path_length_per_step)
 
-        return {
+        step_values = {
             "curvature": Metrics.round_values(curvature),
-            "normalized_curvature": Metrics.round_values(normalized_curvature),
             "roughness": Metrics.round_values(roughness),
-            "path_length_values": Metrics.round_values(path_length_per_step),
-            "path_length": path_length,
             "acceleration": Metrics.round_values(acceleration),
             "jerk": Metrics.round_values(jerk),
-            "velocity": Metrics.round_values(vel_absolute),
+            "velocity": Metrics.round_values(vel_absolute)
+        }
+
+        return {
+            "curvature": step_values["curvature"],
+            "normalized_curvature": Metrics.round_values(normalized_curvature),
+            "roughness": step_values["roughness"],
+            "path_length_values": Metrics.round_values(path_length_per_step),
+            "path_length": path_length,
+            "acceleration": step_values["acceleration"],
+            "jerk": step_values["jerk"],
+            "velocity": step_values["velocity"],
             "collision_amount": collision_amount,
             "collisions": list(collisions),
             "path": [list(p) for p in positions],
             "angle_over_length": self.get_angle_over_length(path_length, positions),
-            "action_type": list(self.get_action_type(episode["cmd_vel"])),
+            "action_type": action_type,
             ## Ros time in ns
             "time_diff": time,
             "time": list(map(int, episode["time"].tolist())),
@@ -136,7 +723,42 @@ class Metrics:
             "result": self.get_success(time, collision_amount),
             "cmd_vel": list(map(list, episode["cmd_vel"].to_list())),
             "goal": goal_position,
-            "start": start_position
+            "start": start_position,
+            **{
+                summary_key: summary_value
+                for key, values in step_values.items()
+                for summary_key, summary_value in Metrics.get_summary(key, values).items()
+            },
+            **self.get_clearance(positions, episode["time"]),
+            **Metrics.get_command_tracking(episode["cmd_vel"], velocities, episode["time"], action_type)
+        }
+
+    def get_clearance(self, positions, times):
+        if self.map_clearance == None:
+            return {}
+
+        return self.map_clearance.get_clearance_metrics(positions, times.to_numpy(), self.clearance_threshold)
+
+    @staticmethod
+    def get_summary(key, values):
+        """
+        Calculates the summary statistics of a per step metric. Aggregated 
+        plots use them instead of loading the complete arrays.
+        """
+        values = np.asarray(values, dtype=float)
+
+        if len(values) <= 0:
+            return {f"{key}_{stat}": np.nan for stat in Config.SUMMARY_STATS}
+
+        p50, p95 = np.percentile(values, [50, 95])
+
+        return {
+            f"{key}_min": values.min(),
+            f"{key}_max": values.max(),
+            f"{key}_mean": values.mean(),
+            f"{key}_std": values.std(),
+            f"{key}_p50": p50,
+            f"{key}_p95": p95
         }
 
     def get_mean_position(self, episode, key):
@@ -207,17 +829,20 @@ class Metrics:
             - Array of tuples with indexs and time in which
             a collision happened
         """
-        collisions = []
         collisions_marker = []
 
-        for i, scan in enumerate(laser_scans):
+        for scan in laser_scans:
+            collisions_marker.append(int(len(scan[scan <= lower_bound]) > 0))
 
-            is_collision = len(scan[scan <= lower_bound]) > 0
+        return Metrics.count_collisions(collisions_marker)
 
-            collisions_marker.append(int(is_collision))
-            
-            if is_collision:
-                collisions.append(i)
+    @staticmethod
+    def count_collisions(collisions_marker):
+        """
+        Returns the indices of all steps marked as collision and the 
+        number of collisions, consecutive marked steps are one collision
+        """
+        collisions = [i for i, is_collision in enumerate(collisions_marker) if is_collision]
 
         collision_amount = 0
 
@@ -230,17 +855,92 @@ class Metrics:
         return collisions, collision_amount
 
     def get_action_type(self, actions):
-        action_type = []
+        actions = Metrics.to_matrix(actions, 3)
+
+        return np.where(
+            actions.sum(axis=1) == 0,
+            Action.STOP,
+            np.where((actions[:, 0] == 0) & (actions[:, 1] == 0), Action.ROTATE, Action.MOVE)
+        ).tolist()
+
+    @staticmethod
+    def to_matrix(rows, width):
+        """
+        Stacks the rows of an episode into a (N x width) matrix. Missing
+        rows, e.g. steps without a recorded action, are zero.
+        """
+        matrix = np.zeros((len(rows), width))
+
+        lengths = np.fromiter((len(row) for row in rows), dtype=int, count=len(rows))
+        complete = lengths >= width
+
+        if complete.any():
+            matrix[complete] = np.stack([np.asarray(row, dtype=float)[:width] for row, is_complete in zip(rows, complete) if is_complete])
+
+        return matrix
+
+    @staticmethod
+    def get_command_tracking(actions, velocities, times, action_type):
+        """
+        Compares the commanded with the measured velocity of every step. The
+        tracking errors are the difference of the linear velocities and of the
+        angular velocities. The actuation lag is the shift of the measured 
+        speed behind the commanded speed maximizing their cross correlation,
+        in the unit of time_diff. Every action type gets its share of the time.
+        """
+        commands = Metrics.to_matrix(actions, 3)
+        measured = Metrics.to_matrix(velocities, 3)
+
+        ## Steps before the first action are not compared
+        has_command = np.fromiter((len(action) > 0 for action in actions), dtype=bool, count=len(actions))
 
-        for action in actions:
-            if sum(action) == 0:
-                action_type.append(Action.STOP)
-            elif action[0] == 0 and action[1] == 0:
-                action_type.append(Action.ROTATE)
-            else:
-                action_type.append(Action.MOVE)
+        linear_error = np.linalg.norm(commands[has_command, :2] - measured[has_command, :2], axis=1)
+        angular_error = np.abs(commands[has_command, 2] - measured[has_command, 2])
 
-        return action_type
+        times = np.asarray(times, dtype=float)
+        step_durations = np.diff(times, append=times[-1])
+        total_duration = step_durations.sum()
+
+        action_type = np.asarray(action_type)
+
+        return {
+            **Metrics.get_summary("tracking_error_linear", linear_error),
+            **Metrics.get_summary("tracking_error_angular", angular_error),
+            "actuation_lag": Metrics.get_actuation_lag(
+                np.linalg.norm(commands[has_command, :2], axis=1),
+                np.linalg.norm(measured[has_command, :2], axis=1),
+                times[has_command]
+            ),
+            **{
+                f"action_share_{action.lower()}": round(float(
+                    step_durations[action_type == action].sum() / total_duration if total_duration > 0
+                    else np.mean(action_type == action)
+                ), 3)
+                for action in [Action.MOVE, Action.STOP, Action.ROTATE]
+            }
+        }
+
+    @staticmethod
+    def get_actuation_lag(commanded, measured, times):
+        """
+        Cross correlates both signals with an fft and returns the lag of the
+        maximum, searching only shifts of the measured signal behind the command
+        """
+        if len(commanded) < 3 or commanded.std() == 0 or measured.std() == 0:
+            return np.nan
+
+        commanded = commanded - commanded.mean()
+        measured = measured - measured.mean()
+
+        size = 2 * len(commanded)
+
+        ## correlation[k] = sum commanded[t] * measured[t + k]
+        correlation = np.fft.irfft(np.conj(np.fft.rfft(commanded, size)) * np.fft.rfft(measured, size), size)
+
+        max_lag = min(Config.MAX_LAG_STEPS, len(commanded) - 1)
+        lag_steps = int(np.argmax(correlation[:max_lag + 1]))
+
+        return int(lag_steps * np.median(np.diff(times)))
 
     def get_curvature(self, positions):
         """
@@ -360,6 +1060,16 @@ class Metrics:
             )
         )
 
+    @staticmethod
+    def read_params(dir):
+        params = os.path.join(dir, "params.yaml")
+
+        if not os.path.exists(params):
+            return {}
+
+        with open(params) as file:
+            return yaml.safe_load(file)
+
     @staticmethod
     def get_robot_params(dir):
         with open(os.path.join(dir, "params.yaml")) as file:
@@ -367,6 +1077,39 @@ class Metrics:
 
             model = content["model"]
 
+        return RobotParamsCache.get(model)
+
+    @staticmethod
+    def get_map_file(dir):
+        with open(os.path.join(dir, "params.yaml")) as file:
+            content = yaml.safe_load(file)
+
+        return MapClearance.find_map_file(content["map_file"])
+
+
+class RobotParamsCache:
+    """
+    Caches the contents of the model_params.yaml of each robot model on disk.
+    An entry is valid as long as the mtime of its file did not change, thus 
+    the arena-simulation-setup package only has to be located for new models.
+    """
+    CACHE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "robot_params_cache.json")
+
+    entries = None
+
+    @staticmethod
+    def get(model):
+        if RobotParamsCache.entries == None:
+            RobotParamsCache.entries = RobotParamsCache.read()
+
+        entry = RobotParamsCache.entries.get(model, None)
+
+        if entry != None and os.path.exists(entry["file"]) and os.path.getmtime(entry["file"]) == entry["mtime"]:
+            return entry["params"]
+
+        ## Only crawl the ros packages if the model is not cached
+        import rospkg
+
         robot_model_params_file = os.path.join(
             rospkg.RosPack().get_path("arena-simulation-setup"), 
             "robot", 
@@ -375,10 +1118,81 @@ class Metrics:
         )
 
         with open(robot_model_params_file, "r") as file:
+            params = yaml.safe_load(file)
+
+        RobotParamsCache.entries[model] = {
+            "file": robot_model_params_file,
+            "mtime": os.path.getmtime(robot_model_params_file),
+            "params": params
+        }
+
+        RobotParamsCache.write()
+
+        return params
+
+    @staticmethod
+    def read():
+        try:
+            with open(RobotParamsCache.CACHE_FILE) as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return {}
+
+    @staticmethod
+    def write():
+        ## Replaced atomically, parallel evaluations only read complete caches
+        temporary_file = f"{RobotParamsCache.CACHE_FILE}.{os.getpid()}"
+
+        try:
+            with open(temporary_file, "w") as file:
+                json.dump(RobotParamsCache.entries, file)
+
+            os.replace(temporary_file, RobotParamsCache.CACHE_FILE)
+        except OSError:
+            print("Robot params cache", RobotParamsCache.CACHE_FILE, "cannot be written")
+
+
+def get_robot_params_override(arguments):
+    if arguments.robot_params != None:
+        with open(arguments.robot_params) as file:
             return yaml.safe_load(file)
 
+    if arguments.robot_radius != None:
+        return {"robot_radius": arguments.robot_radius}
+
+    return None
+
+
+def create_metrics(dir, arguments):
+    return Metrics(
+        dir, 
+        stream=arguments.stream, 
+        chunk_size=arguments.chunk_size, 
+        tolerance=arguments.tolerance,
+        robot_params=get_robot_params_override(arguments),
+        watch=arguments.watch,
+        poll_interval=arguments.poll_interval,
+        episode=arguments.episode,
+        jobs=arguments.jobs,
+        clearance=arguments.clearance,
+        map_file=arguments.map,
+        clearance_threshold=arguments.clearance_threshold,
+        scan_store=arguments.scan_store,
+        scan_dtype=arguments.scan_dtype
+    )
+
 
 if __name__ == "__main__":
     arguments = parse_args()
 
-    Metrics(arguments.dir)
+    if arguments.worker:
+        WorkQueue(
+            arguments.data_dir,
+            lock_timeout=arguments.lock_timeout,
+            heartbeat_interval=arguments.heartbeat,
+            poll_interval=arguments.poll_interval,
+            retry_failed=arguments.retry_failed,
+            include_unmarked=arguments.include_unmarked
+        ).run(lambda dir: create_metrics(dir, arguments))
+    else:
+        create_metrics(arguments.dir, arguments)
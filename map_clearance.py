@@ -0,0 +1,146 @@
+"""
+Clearance of the robot to the static obstacles of the map.
+
+The euclidean distance transform of the occupancy image is calculated once
+per map and cached in data/map_cache. The clearance of every position of an
+episode is then a single lookup in the distance image.
+"""
+import os
+import hashlib
+import yaml
+
+from utils import LazyModule
+
+np = LazyModule("numpy")
+
+
+class MapClearance:
+    CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "map_cache")
+
+    ## Loaded maps, shared by all runs evaluated in one process
+    instances = {}
+
+    def __init__(self, map_file):
+        with open(map_file) as file:
+            self.map_content = yaml.safe_load(file)
+
+        self.resolution = self.map_content["resolution"]
+        self.origin = self.map_content["origin"]
+
+        self.distances = MapClearance.load_distance_transform(
+            os.path.join(os.path.dirname(map_file), self.map_content["image"]),
+            self.map_content
+        )
+
+    @staticmethod
+    def get(map_file):
+        map_file = os.path.abspath(map_file)
+
+        if map_file not in MapClearance.instances:
+            MapClearance.instances[map_file] = MapClearance(map_file)
+
+        return MapClearance.instances[map_file]
+
+    @staticmethod
+    def find_map_file(map_name):
+        """
+        Returns the map.yaml of a map in the arena-simulation-setup package.
+        Paths to a yaml file are returned as they are.
+        """
+        if map_name.endswith(".yaml") and os.path.exists(map_name):
+            return map_name
+
+        import rospkg
+
+        return os.path.join(rospkg.RosPack().get_path("arena-simulation-setup"), "maps", map_name, "map.yaml")
+
+    @staticmethod
+    def load_distance_transform(image_path, map_content):
+        stat = os.stat(image_path)
+
+        key = hashlib.sha1(":".join([
+            os.path.abspath(image_path),
+            str(stat.st_mtime),
+            str(stat.st_size),
+            str(map_content["resolution"]),
+            str(map_content.get("occupied_thresh", 0.65)),
+            str(map_content.get("negate", 0))
+        ]).encode()).hexdigest()[:16]
+
+        name = os.path.splitext(os.path.basename(image_path))[0]
+        cache_file = os.path.join(MapClearance.CACHE_DIR, f"{name}_{key}.npy")
+
+        if os.path.exists(cache_file):
+            return np.load(cache_file, mmap_mode="r")
+
+        distances = MapClearance.compute_distance_transform(image_path, map_content)
+
+        os.makedirs(MapClearance.CACHE_DIR, exist_ok=True)
+
+        ## Write to a temporary file first, parallel evaluations may create the same cache
+        temporary_file = f"{cache_file}.{os.getpid()}.npy"
+        np.save(temporary_file, distances)
+        os.replace(temporary_file, cache_file)
+
+        return distances
+
+    @staticmethod
+    def compute_distance_transform(image_path, map_content):
+        """
+        Returns the distance of every pixel to the next occupied pixel in meters
+        """
+        from matplotlib.image import imread
+        from scipy.ndimage import distance_transform_edt
+
+        image = np.asarray(imread(image_path), dtype=float)
+
+        if image.ndim == 3:
+            image = image[..., :3].mean(axis=2)
+
+        if image.max() > 1:
+            image = image / 255
+
+        ## Same interpretation of the image as the ros map server
+        occupancy = image if map_content.get("negate", 0) else 1 - image
+        occupied = occupancy > map_content.get("occupied_thresh", 0.65)
+
+        return (distance_transform_edt(~occupied) * map_content["resolution"]).astype(np.float32)
+
+    def get_clearance(self, positions):
+        """
+        Looks up the clearance of all positions at once. Positions
+        outside of the map have no clearance.
+        """
+        positions = np.asarray(positions, dtype=float).reshape(-1, 3)
+
+        height, width = self.distances.shape
+
+        cols = np.floor((positions[:, 0] - self.origin[0]) / self.resolution).astype(int)
+        rows = height - 1 - np.floor((positions[:, 1] - self.origin[1]) / self.resolution).astype(int)
+
+        inside = (rows >= 0) & (rows < height) & (cols >= 0) & (cols < width)
+
+        clearance = np.full(len(positions), np.nan)
+        clearance[inside] = self.distances[rows[inside], cols[inside]]
+
+        return clearance
+
+    def get_clearance_metrics(self, positions, times, threshold):
+        clearance = self.get_clearance(positions)
+
+        if np.isnan(clearance).all():
+            return {
+                "clearance_min": np.nan,
+                "clearance_mean": np.nan,
+                "clearance_below_threshold_time": 0
+            }
+
+        ## Duration of every step until the next one
+        times = np.asarray(times, dtype=float)
+        step_durations = np.diff(times, append=times[-1])
+
+        return {
+            "clearance_min": round(float(np.nanmin(clearance)), 3),
+            "clearance_mean": round(float(np.nanmean(clearance)), 3),
+            "clearance_below_threshold_time": int(step_durations[clearance < threshold].sum())
+        }
@@ -0,0 +1,209 @@
+"""
+Compact storage for the per step values of many episodes.
+
+The values of all episodes are stored in one contiguous buffer together with
+the offsets at which every episode starts. The cells of a DataFrame coloumn
+are views into this buffer, thus code treating them as sequences keeps working,
+while a coloumn of thousands of episodes is a single allocation instead of
+millions of python objects.
+
+The buffer of such a coloumn is accessible with series.ragged, e.g.
+    dataset["velocity"].ragged.buffer
+    dataset["velocity"].ragged.lengths
+    dataset["velocity"].ragged.explode()
+"""
+import warnings
+
+from utils import LazyModule
+
+np = LazyModule("numpy")
+pd = LazyModule("pandas")
+
+
+class RaggedArray:
+    def __init__(self, buffer, offsets):
+        self.buffer = buffer
+        self.offsets = offsets
+
+    @staticmethod
+    def from_sequences(sequences, dtype=None):
+        """
+        Copies the sequences into one buffer. Sequences of sequences, e.g.
+        positions, are stored as rows of a two dimensional buffer, thus all
+        of their elements need the same length.
+        """
+        arrays = [np.asarray(sequence, dtype=dtype) for sequence in sequences]
+
+        shapes = set(array.shape[1:] for array in arrays if len(array) > 0)
+
+        if len(shapes) > 1:
+            raise ValueError(f"Elements of a ragged array have different shapes {shapes}")
+
+        trailing_shape = shapes.pop() if len(shapes) > 0 else ()
+
+        arrays = [array.reshape(-1, *trailing_shape) for array in arrays]
+
+        offsets = np.zeros(len(arrays) + 1, dtype=np.int64)
+        np.cumsum([len(array) for array in arrays], out=offsets[1:])
+
+        if len(arrays) == 0:
+            return RaggedArray(np.empty((0, *trailing_shape), dtype=dtype), offsets)
+
+        return RaggedArray(np.concatenate(arrays), offsets)
+
+    @staticmethod
+    def from_strings(strings, dtype="float64"):
+        """
+        Parses the csv representation of number sequences, e.g. "[1.0, 2.0]" or
+        "[[1.0, 2.0], [3.0, 4.0]]", directly into the buffer without creating
+        python lists. Raises a ValueError for cells of other formats or nested
+        sequences of different lengths.
+        """
+        cells = [cell if isinstance(cell, str) else "" for cell in strings]
+        values = [cell.replace("[", "").replace("]", "") for cell in cells]
+
+        counts = np.array([value.count(",") + 1 if value.strip() else 0 for value in values], dtype=np.int64)
+
+        nested = np.array([cell.lstrip().startswith("[[") for cell in cells], dtype=bool)
+        lengths = np.where(nested, [cell.count("[") - 1 for cell in cells], counts)
+
+        width = None
+
+        if nested.any():
+            width = counts[nested][0] // max(lengths[nested][0], 1)
+
+            ## Every non empty cell has to be a nested sequence of the same width
+            if (~nested & (counts > 0)).any() or not np.array_equal(lengths * width, counts):
+                raise ValueError("Nested sequences of a ragged array have different lengths")
+
+        buffer = np.empty(0, dtype=np.float64)
+
+        if counts.sum() > 0:
+            ## Older numpy versions only warn about unparseable values
+            with warnings.catch_warnings():
+                warnings.simplefilter("error", DeprecationWarning)
+
+                try:
+                    buffer = np.fromstring(",".join([value for value, count in zip(values, counts) if count > 0]), sep=",")
+                except DeprecationWarning as e:
+                    raise ValueError(str(e))
+
+        if len(buffer) != counts.sum():
+            raise ValueError("Cells of a ragged array are no number sequences")
+
+        offsets = np.zeros(len(cells) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+
+        buffer = buffer.astype(dtype)
+
+        return RaggedArray(buffer if width == None else buffer.reshape(-1, width), offsets)
+
+    @staticmethod
+    def concatenate(ragged_arrays):
+        offsets = [ragged_arrays[0].offsets[:1]]
+        start = 0
+
+        for ragged_array in ragged_arrays:
+            offsets.append(ragged_array.offsets[1:] + start)
+            start += len(ragged_array.buffer)
+
+        ## Empty buffers lack the trailing shape of nested sequences
+        buffers = [ragged_array.buffer for ragged_array in ragged_arrays if len(ragged_array.buffer) > 0]
+
+        return RaggedArray(
+            np.concatenate(buffers) if len(buffers) > 0 else ragged_arrays[0].buffer,
+            np.concatenate(offsets)
+        )
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        return self.buffer[self.offsets[index]:self.offsets[index + 1]]
+
+    @property
+    def lengths(self):
+        return np.diff(self.offsets)
+
+    def to_series(self, index=None, name=None):
+        register_accessor()
+
+        ## Filled one by one, otherwise numpy stacks cells of equal length
+        cells = np.empty(len(self), dtype=object)
+
+        for i in range(len(self)):
+            cells[i] = self[i]
+
+        return pd.Series(cells, index=index, name=name)
+
+
+class RaggedAccessor:
+    def __init__(self, series):
+        self.series = series
+
+    @property
+    def array(self):
+        """
+        Returns the ragged array of the coloumn. If the cells are consecutive
+        views into the same buffer no values are copied.
+        """
+        cells = self.series.to_list()
+
+        if len(cells) > 0 and all(isinstance(cell, np.ndarray) for cell in cells):
+            buffer = cells[0].base
+
+            if buffer is not None and all(cell.base is buffer for cell in cells):
+                row_size = buffer.strides[0]
+                address = buffer.__array_interface__["data"][0]
+
+                starts = np.array([(cell.__array_interface__["data"][0] - address) // row_size for cell in cells])
+                lengths = np.array([len(cell) for cell in cells])
+
+                offsets = np.zeros(len(cells) + 1, dtype=np.int64)
+                np.cumsum(lengths, out=offsets[1:])
+
+                ## Empty cells can point anywhere, only the others have to follow each other
+                non_empty = lengths > 0
+                first = starts[non_empty][0] if non_empty.any() else 0
+
+                if np.array_equal(starts[non_empty], first + offsets[:-1][non_empty]):
+                    return RaggedArray(buffer[first:first + offsets[-1]], offsets)
+
+        return RaggedArray.from_sequences(cells)
+
+    @property
+    def buffer(self):
+        return self.array.buffer
+
+    @property
+    def offsets(self):
+        return self.array.offsets
+
+    @property
+    def lengths(self):
+        return np.array([len(cell) for cell in self.series], dtype=np.int64)
+
+    def explode(self):
+        """
+        Vectorized version of Series.explode, the values keep their dtype
+        """
+        array = self.array
+
+        return pd.Series(
+            list(array.buffer) if array.buffer.ndim > 1 else array.buffer,
+            index=self.series.index.repeat(array.lengths),
+            name=self.series.name
+        )
+
+
+accessor_registered = False
+
+def register_accessor():
+    global accessor_registered
+
+    if accessor_registered:
+        return
+
+    pd.api.extensions.register_series_accessor("ragged")(RaggedAccessor)
+
+    accessor_registered = True
@@ -0,0 +1,346 @@
+#!/usr/bin/env python3
+"""
+Local index over all evaluated runs in ./data
+
+The params of every run and the scalar metrics of its episodes are stored
+in a sqlite database, so runs can be selected without opening every directory.
+The index is updated incrementally, only runs whose files changed are read again.
+
+All recorded positions are additionally stored in grid cells, thus episodes
+passing through a region or collisions in a region are found without
+reading the paths of all runs.
+
+Usage:
+    python run_index.py update
+    python run_index.py query "local_planner = 'teb' AND map_file LIKE '%warehouse%'"
+    python run_index.py region -1 2 1 4 --collisions
+"""
+import os
+import json
+import sqlite3
+import argparse
+
+import yaml
+
+from utils import LazyModule
+
+pd = LazyModule("pandas")
+
+
+RUN_KEYS = [
+    "model",
+    "map_file",
+    "scenario_file",
+    "local_planner",
+    "agent_name",
+    "namespace"
+]
+
+## Edge length in m of the grid cells of the spatial index
+CELL_SIZE = 1.0
+
+## Increased whenever the tables change, older indices are built again
+SCHEMA_VERSION = 2
+
+EPISODE_KEYS = [
+    "result",
+    "time_diff",
+    "path_length",
+    "collision_amount",
+    "angle_over_length"
+]
+
+
+class RunIndex:
+    def __init__(self, data_dir="data", database=None):
+        self.data_dir = data_dir
+        self.database = database or os.path.join(data_dir, "index.sqlite")
+
+        self.connection = sqlite3.connect(self.database)
+
+        self.create_tables()
+        self.migrate()
+
+    def create_tables(self):
+        self.connection.executescript(f"""
+            CREATE TABLE IF NOT EXISTS runs (
+                run TEXT PRIMARY KEY,
+                {", ".join([key + " TEXT" for key in RUN_KEYS])},
+                params TEXT,
+                params_mtime REAL,
+                metrics_mtime REAL
+            );
+            CREATE TABLE IF NOT EXISTS episodes (
+                run TEXT,
+                episode INTEGER,
+                result TEXT,
+                time_diff REAL,
+                path_length REAL,
+                collision_amount INTEGER,
+                angle_over_length REAL,
+                PRIMARY KEY (run, episode)
+            );
+            CREATE TABLE IF NOT EXISTS positions (
+                run TEXT,
+                episode INTEGER,
+                step INTEGER,
+                x REAL,
+                y REAL,
+                cell_x INTEGER,
+                cell_y INTEGER,
+                collision INTEGER
+            );
+            CREATE INDEX IF NOT EXISTS positions_cell ON positions (cell_x, cell_y);
+            CREATE INDEX IF NOT EXISTS positions_run ON positions (run);
+        """)
+
+    def migrate(self):
+        version = self.connection.execute("PRAGMA user_version").fetchone()[0]
+
+        if version >= SCHEMA_VERSION:
+            return
+
+        ## Runs indexed by an older version are read again on the next update
+        self.connection.execute("UPDATE runs SET params_mtime = NULL, metrics_mtime = NULL")
+        self.connection.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        self.connection.commit()
+
+    def update(self):
+        """
+        Adds new runs, reads runs with changed params or metrics again
+        and removes runs which no longer exist.
+
+        Returns the names of the updated runs
+        """
+        indexed = {
+            run: (params_mtime, metrics_mtime)
+            for run, params_mtime, metrics_mtime
+            in self.connection.execute("SELECT run, params_mtime, metrics_mtime FROM runs")
+        }
+
+        existing = []
+        updated = []
+
+        for run in sorted(os.listdir(self.data_dir)):
+            params = os.path.join(self.data_dir, run, "params.yaml")
+            metrics = os.path.join(self.data_dir, run, "metrics.csv")
+
+            if not os.path.exists(params) or not os.path.exists(metrics):
+                continue
+
+            existing.append(run)
+
+            mtimes = (os.path.getmtime(params), os.path.getmtime(metrics))
+
+            if indexed.get(run) == mtimes:
+                continue
+
+            try:
+                self.ingest_run(run, params, metrics, mtimes)
+            except Exception as e:
+                print("Run", run, "cannot be indexed:", e)
+                continue
+
+            updated.append(run)
+
+        for run in set(indexed) - set(existing):
+            self.remove_run(run)
+
+        self.connection.commit()
+
+        return updated
+
+    def ingest_run(self, run, params, metrics, mtimes):
+        with open(params) as file:
+            params_content = yaml.safe_load(file)
+
+        ## Only the scalar coloumns and the positions are parsed, the other per step arrays are skipped
+        episodes = pd.read_csv(
+            metrics,
+            usecols=lambda c: c in ["episode", "path", "collisions", *EPISODE_KEYS],
+            converters={"path": json.loads, "collisions": json.loads}
+        )
+
+        self.remove_run(run)
+
+        self.connection.execute(
+            f"INSERT INTO runs VALUES ({', '.join(['?'] * (len(RUN_KEYS) + 4))})",
+            [
+                run,
+                *[params_content.get(key) for key in RUN_KEYS],
+                json.dumps(params_content),
+                *mtimes
+            ]
+        )
+
+        self.connection.executemany(
+            f"INSERT INTO episodes VALUES ({', '.join(['?'] * (len(EPISODE_KEYS) + 2))})",
+            [
+                [run, int(row["episode"]), *[RunIndex.to_sql_value(row.get(key)) for key in EPISODE_KEYS]]
+                for row in episodes.to_dict("records")
+            ]
+        )
+
+        self.connection.executemany(
+            "INSERT INTO positions VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            [
+                position
+                for row in episodes.to_dict("records")
+                for position in RunIndex.get_positions(run, row)
+            ]
+        )
+
+    def remove_run(self, run):
+        self.connection.execute("DELETE FROM runs WHERE run = ?", [run])
+        self.connection.execute("DELETE FROM episodes WHERE run = ?", [run])
+        self.connection.execute("DELETE FROM positions WHERE run = ?", [run])
+
+    def query_runs(self, filter=None):
+        """
+        Returns the names of all runs matching the filter. The filter is
+        an sql expression over the coloumns of the runs table, e.g.
+        "local_planner = 'teb' AND model = 'jackal'"
+        """
+        where = f"WHERE {filter}" if filter else ""
+
+        return [
+            run for run,
+            in self.connection.execute(f"SELECT run FROM runs {where} ORDER BY run")
+        ]
+
+    def query_episodes(self, filter=None):
+        """
+        Returns the scalar metrics of all episodes of the runs matching the filter.
+        The filter can use the coloumns of both the runs and the episodes table.
+        """
+        where = f"WHERE {filter}" if filter else ""
+
+        return pd.read_sql_query(
+            f"SELECT * FROM episodes JOIN runs USING (run) {where} ORDER BY run, episode",
+            self.connection
+        )
+
+    def query_region(self, x_min, y_min, x_max, y_max, collisions_only=False, filter=None):
+        """
+        Returns all recorded positions inside the rectangle with their run, episode
+        and step. Only the grid cells overlapping the rectangle are searched.
+        The filter can use the coloumns of the runs table.
+        """
+        conditions = [
+            "cell_x BETWEEN ? AND ?",
+            "cell_y BETWEEN ? AND ?",
+            "x BETWEEN ? AND ?",
+            "y BETWEEN ? AND ?"
+        ]
+
+        if collisions_only:
+            conditions.append("collision = 1")
+
+        if filter:
+            conditions.append(f"run IN (SELECT run FROM runs WHERE {filter})")
+
+        return pd.read_sql_query(
+            f"SELECT run, episode, step, x, y, collision FROM positions WHERE {' AND '.join(conditions)} ORDER BY run, episode, step",
+            self.connection,
+            params=[
+                RunIndex.get_cell(x_min), RunIndex.get_cell(x_max),
+                RunIndex.get_cell(y_min), RunIndex.get_cell(y_max),
+                x_min, x_max,
+                y_min, y_max
+            ]
+        )
+
+    def query_episodes_in_region(self, x_min, y_min, x_max, y_max, collisions_only=False, filter=None):
+        """
+        Returns the (run, episode) pairs of all episodes passing through the
+        rectangle, or colliding in it if collisions_only is set
+        """
+        positions = self.query_region(x_min, y_min, x_max, y_max, collisions_only, filter)
+
+        return list(positions[["run", "episode"]].drop_duplicates().itertuples(index=False, name=None))
+
+    def close(self):
+        self.connection.close()
+
+    @staticmethod
+    def get_cell(coordinate):
+        return int(coordinate // CELL_SIZE)
+
+    @staticmethod
+    def get_positions(run, row):
+        collisions = set(row.get("collisions", []))
+
+        return [
+            [
+                run,
+                int(row["episode"]),
+                step,
+                position[0],
+                position[1],
+                RunIndex.get_cell(position[0]),
+                RunIndex.get_cell(position[1]),
+                int(step in collisions)
+            ]
+            for step, position in enumerate(row.get("path", []))
+        ]
+
+    @staticmethod
+    def to_sql_value(value):
+        if isinstance(value, float) and value != value:
+            return None
+
+        if hasattr(value, "item"):
+            return value.item()
+
+        return value
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("command", choices=["update", "query", "region"])
+    parser.add_argument("arguments", nargs="*", help="query: SQL expression to select runs, region: x_min y_min x_max y_max")
+    parser.add_argument("--filter", default=None, help="SQL expression to select runs for a region query")
+    parser.add_argument("--collisions", action="store_true", help="Only find collisions in the region")
+    parser.add_argument("--episodes", action="store_true", help="Print the episodes instead of the run names")
+    parser.add_argument("--data-dir", default="data")
+    parser.add_argument("--database", default=None)
+
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    index = RunIndex(args.data_dir, args.database)
+
+    if args.command == "update":
+        updated = index.update()
+
+        print("Updated", len(updated), "runs")
+
+        for run in updated:
+            print(run)
+    elif args.command == "region":
+        index.update()
+
+        x_min, y_min, x_max, y_max = map(float, args.arguments)
+
+        if args.episodes:
+            for run, episode in index.query_episodes_in_region(x_min, y_min, x_max, y_max, args.collisions, args.filter):
+                print(run, episode)
+        else:
+            print(index.query_region(x_min, y_min, x_max, y_max, args.collisions, args.filter).to_string())
+    else:
+        ## Always query an up to date index
+        index.update()
+
+        filter = args.arguments[0] if len(args.arguments) > 0 else None
+
+        if args.episodes:
+            print(index.query_episodes(filter).to_string())
+        else:
+            for run in index.query_runs(filter):
+                print(run)
+
+    index.close()
@@ -0,0 +1,193 @@
+"""
+Laser scans of a run stored as one contiguous matrix.
+
+scan.csv is converted once into scans.bin, a (N x beams) matrix of float32
+ranges or uint16 ranges in mm, and scans_index.npy with the time of every
+row. Both are opened with np.memmap, thus the scans of an episode are a
+view into the file and recordings larger than the memory can
+be analyzed. The store is built again when the recording changed.
+"""
+import os
+import json
+
+from utils import Utils, LazyModule
+
+np = LazyModule("numpy")
+pd = LazyModule("pandas")
+
+
+class ScanStore:
+    DATA_FILE = "scans.bin"
+    INDEX_FILE = "scans_index.npy"
+    META_FILE = "scans_meta.json"
+
+    DTYPES = ["float32", "uint16"]
+
+    ## Resolution in m of uint16 ranges, the maximal value marks invalid ranges
+    UINT16_SCALE = 0.001
+    UINT16_INVALID = 65535
+
+    ## Number of scans parsed at once while building the store
+    CHUNK_SIZE = 5000
+
+    def __init__(self, dir):
+        with open(os.path.join(dir, ScanStore.META_FILE)) as file:
+            self.meta = json.load(file)
+
+        self.dtype = self.meta["dtype"]
+        self.beams = self.meta["beams"]
+
+        self.index = np.load(os.path.join(dir, ScanStore.INDEX_FILE), mmap_mode="r")
+
+        ## Empty files cannot be mapped
+        if self.meta["rows"] <= 0:
+            self.scans = np.empty((0, self.beams), dtype=self.dtype)
+        else:
+            self.scans = np.memmap(
+                os.path.join(dir, ScanStore.DATA_FILE),
+                dtype=self.dtype,
+                mode="r",
+                shape=(self.meta["rows"], self.beams)
+            )
+
+    @staticmethod
+    def get(dir, dtype="float32"):
+        """
+        Opens the scan store of the run, it is built first if it
+        does not exist or the recording changed
+        """
+        assert dtype in ScanStore.DTYPES, f"Invalid dtype {dtype} for the scan store"
+
+        if not ScanStore.is_up_to_date(dir, dtype):
+            ScanStore.build(dir, dtype)
+
+        return ScanStore(dir)
+
+    @staticmethod
+    def get_source_version(dir):
+        stat = os.stat(os.path.join(dir, "scan.csv"))
+
+        return [stat.st_mtime, stat.st_size]
+
+    @staticmethod
+    def is_up_to_date(dir, dtype):
+        meta_file = os.path.join(dir, ScanStore.META_FILE)
+
+        if not os.path.exists(meta_file):
+            return False
+
+        with open(meta_file) as file:
+            meta = json.load(file)
+
+        return meta["dtype"] == dtype and meta["source"] == ScanStore.get_source_version(dir)
+
+    @staticmethod
+    def build(dir, dtype):
+        """
+        Converts scan.csv chunk by chunk, thus only one chunk of scans is in memory
+        """
+        version = ScanStore.get_source_version(dir)
+
+        data_file = os.path.join(dir, ScanStore.DATA_FILE)
+        temporary_data_file = f"{data_file}.{os.getpid()}"
+
+        times = []
+        rows = 0
+        beams = None
+
+        with open(temporary_data_file, "wb") as file:
+            for chunk in pd.read_csv(
+                os.path.join(dir, "scan.csv"),
+                converters={"data": Utils.string_to_float_list},
+                dtype={"time": "float64"},
+                chunksize=ScanStore.CHUNK_SIZE
+            ):
+                if len(chunk) <= 0:
+                    continue
+
+                if beams == None:
+                    beams = len(chunk["data"].iloc[0])
+
+                ## Scans with a different number of beams are cut or filled with invalid ranges
+                matrix = np.full((len(chunk), beams), np.inf, dtype=np.float32)
+
+                for i, scan in enumerate(chunk["data"]):
+                    length = min(len(scan), beams)
+                    matrix[i, :length] = scan[:length]
+
+                ScanStore.encode(matrix, dtype).tofile(file)
+
+                times.append(chunk["time"].to_numpy())
+                rows += len(chunk)
+
+        index = np.concatenate(times) if len(times) > 0 else np.empty(0)
+
+        index_file = os.path.join(dir, ScanStore.INDEX_FILE)
+        temporary_index_file = f"{index_file}.{os.getpid()}.npy"
+
+        np.save(temporary_index_file, index.astype(np.float64))
+
+        os.replace(temporary_data_file, data_file)
+        os.replace(temporary_index_file, index_file)
+
+        ## The meta file is written last, a store without it is incomplete
+        meta_file = os.path.join(dir, ScanStore.META_FILE)
+
+        with open(f"{meta_file}.{os.getpid()}", "w") as file:
+            json.dump({"dtype": dtype, "rows": rows, "beams": beams or 0, "source": version}, file)
+
+        os.replace(f"{meta_file}.{os.getpid()}", meta_file)
+
+    @staticmethod
+    def encode(ranges, dtype):
+        if dtype == "float32":
+            return ranges
+
+        invalid = ~np.isfinite(ranges)
+
+        values = np.clip(np.round(np.nan_to_num(ranges) / ScanStore.UINT16_SCALE), 0, ScanStore.UINT16_INVALID - 1).astype(np.uint16)
+        values[invalid] = ScanStore.UINT16_INVALID
+
+        return values
+
+    def to_units(self, distance):
+        """
+        Converts a distance in m to the units of the stored ranges
+        """
+        if self.dtype == "float32":
+            return distance
+
+        return distance / ScanStore.UINT16_SCALE
+
+    def get_index_frame(self):
+        """
+        Returns the time and the row of every scan, it is joined onto
+        the steps instead of the scans
+        """
+        return pd.DataFrame({
+            "time": np.asarray(self.index),
+            "scan_row": np.arange(len(self.index))
+        })
+
+    def get_collision_markers(self, scan_rows, lower_bound):
+        """
+        Marks the steps whose scan has a range at or below the lower bound.
+        Steps without a scan are no collisions.
+        """
+        scan_rows = np.asarray(scan_rows, dtype=float)
+        has_scan = ~np.isnan(scan_rows)
+
+        markers = np.zeros(len(scan_rows), dtype=int)
+
+        if not has_scan.any():
+            return markers
+
+        scan_rows = scan_rows[has_scan].astype(np.int64)
+        first, last = scan_rows.min(), scan_rows.max()
+
+        ## The scans of an episode are a block of the file, only this view is read
+        is_collision = (self.scans[first:last + 1] <= self.to_units(lower_bound)).any(axis=1)
+
+        markers[has_scan] = is_collision[scan_rows - first]
+
+        return markers
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""
+Creates a recording from a rosbag without replaying the simulation.
+
+The messages of the bag are passed to the callbacks of the data recorder
+in the order they were recorded, thus the same sampling is applied as
+during a live recording, but at full speed. The result directories have
+the same layout as the ones of data_recorder_node.py.
+
+Since parameters are not part of a bag, the params of the run are read
+from a yaml file in the format of params.yaml. Values for a single robot
+can be nested under its namespace, e.g.
+
+    model: jackal
+    local_planner: teb
+    jackal_1:
+        local_planner: dwa
+
+Usage:
+    python bag_recorder.py run.bag --params params.yaml --metrics
+"""
+import os
+import sys
+import argparse
+from datetime import datetime
+from threading import RLock
+
+import yaml
+import rosbag
+
+from data_recorder_node import DataCollector, NamespaceRecorder, Recorder
+
+
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class BagNamespaceRecorder(NamespaceRecorder):
+    ## Bags recorded with sim time start at the same time, their recordings must not overwrite each other
+    REUSE_RESULT_DIR = False
+
+    def __init__(self, dir, namespace, published_topics, timestamp, params, segment_episodes=False):
+        self.params = {
+            **{key: value for key, value in params.items() if not isinstance(value, dict)},
+            **params.get(namespace.strip("/"), {})
+        }
+
+        super().__init__(dir, namespace, published_topics, timestamp, segment_episodes)
+
+    def create_collector(self, topic):
+        return DataCollector(topic, subscribe=False)
+
+    def get_param(self, name, *default):
+        name = name.lstrip("/")
+
+        if name in self.params:
+            return self.params[name]
+
+        if len(default) > 0:
+            return default[0]
+
+        raise KeyError(f"Parameter {name} of {self.namespace} is missing in the params file")
+
+
+class BagRecorder(Recorder):
+    """
+    Reads a rosbag and feeds the /clock, /scenario_reset and robot topics
+    to the same callbacks the live recorder uses.
+    """
+    def __init__(self, bag_file, dir=PACKAGE_DIR, namespaces=None, params={}):
+        self.dir = dir
+
+        self.config = self.read_config()
+        self.record_frequency = Recorder.get_record_frequency(self.config)
+
+        self.bag = rosbag.Bag(bag_file)
+
+        published_topics = [
+            [topic_name, info.msg_type]
+            for topic_name, info in self.bag.get_type_and_topic_info().topics.items()
+        ]
+
+        ## Parameters are not recorded, thus every namespace publishing odometry is recorded
+        if namespaces == None:
+            namespaces = Recorder.discover_namespaces(published_topics, has_param=lambda name: True)
+
+        timestamp = "_".join([
+            os.path.splitext(os.path.basename(bag_file))[0],
+            datetime.fromtimestamp(self.bag.get_start_time()).strftime("%d-%m-%Y_%H-%M-%S")
+        ])
+
+        self.namespace_recorders = [
+            BagNamespaceRecorder(self.dir, namespace, published_topics, timestamp, params, self.config.get("segment_episodes", False))
+            for namespace in namespaces
+        ]
+
+        self.current_episode = 0
+        self.current_time = None
+
+        self.start_time = None
+        self.finished = False
+
+        self.lock = RLock()
+
+    def run(self):
+        """
+        Returns the result directories of all recorded namespaces
+        """
+        callbacks = {
+            "/clock": self.clock_callback,
+            "/scenario_reset": self.scenario_reset_callback
+        }
+
+        for namespace_recorder in self.namespace_recorders:
+            for collector in namespace_recorder.data_collectors:
+                callbacks[collector.topic_name] = collector.callback
+
+        clock_time = None
+
+        for topic, msg, _ in self.bag.read_messages(topics=list(callbacks.keys())):
+            if self.finished:
+                break
+
+            if topic == "/clock":
+                clock_time = msg.clock.secs + msg.clock.nsecs / 1e9
+
+            callbacks[topic](msg)
+
+        ## The bag ended before a limit was reached, the recording is complete nevertheless
+        if not self.finished:
+            elapsed_time = 0 if self.start_time is None else clock_time - self.start_time
+
+            self.finish("end_of_bag", elapsed_time)
+
+        self.bag.close()
+
+        return [namespace_recorder.result_dir for namespace_recorder in self.namespace_recorders]
+
+    def signal_finish(self, reason):
+        ## Reading the bag stops as soon as the recorder is finished
+        pass
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("bag_file")
+    parser.add_argument("--params", "-p", default=None, help="Yaml file with the params of the run")
+    parser.add_argument("--namespace", "-n", action="append", default=None, help="Namespace to record, defaults to all robots in the bag")
+    parser.add_argument("--metrics", action="store_true", help="Calculate the metrics of the recordings afterwards")
+    parser.add_argument("--robot-radius", type=float, default=None, help="Robot radius used for the metrics instead of the model params")
+
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    params = {}
+
+    if args.params != None:
+        with open(args.params) as file:
+            params = yaml.safe_load(file)
+
+    namespaces = None
+
+    if args.namespace != None:
+        namespaces = [("/" + namespace.strip("/") + "/").replace("//", "/") for namespace in args.namespace]
+
+    result_dirs = BagRecorder(args.bag_file, namespaces=namespaces, params=params).run()
+
+    for result_dir in result_dirs:
+        print("Recorded", result_dir)
+
+    if args.metrics:
+        sys.path.insert(0, PACKAGE_DIR)
+
+        from get_metrics import Metrics
+
+        robot_params = None if args.robot_radius == None else {"robot_radius": args.robot_radius}
+
+        for result_dir in result_dirs:
+            Metrics(result_dir, robot_params=robot_params)
@@ -2,7 +2,7 @@
 
 # general packages
 from math import nan
-from threading import current_thread
+from threading import current_thread, RLock
 import time
 import numpy as np
 import csv
@@ -21,7 +21,7 @@ import yaml
 
 # ros packages
 import rospy
-from std_msgs.msg import Int16
+from std_msgs.msg import Int16, String
 from geometry_msgs.msg import Pose2D, Pose, PoseWithCovarianceStamped
 from geometry_msgs.msg import Twist
 from sensor_msgs.msg import LaserScan
@@ -32,7 +32,7 @@ from tf.transformations import euler_from_quaternion
 
 
 class DataCollector:
-    def __init__(self, topic):
+    def __init__(self, topic, subscribe=True):
         topic_callbacks = [
             ("scan", self.laserscan_callback),
             ("odom", self.odometry_callback),
@@ -45,12 +45,18 @@ class DataCollector:
             traceback.print_exc()
             return
 
+        self.topic_name = topic[0]
         self.full_topic_name = topic[1]
         self.data = None
+        self.last_record_time = None
+        self.last_recorded_values = None
+        self.callback = callback
 
         print(topic[0])
 
-        self.subscriber = rospy.Subscriber(topic[0], topic[2], callback)
+        ## Offline ingestion passes the messages to the callback directly
+        if subscribe:
+            self.subscriber = rospy.Subscriber(topic[0], topic[2], callback)
 
     def episode_callback(self, msg_scenario_reset):
         print(msg_scenario_reset)
@@ -103,27 +109,81 @@ class DataCollector:
             self.data 
         )
 
+    def should_record(self, current_time, topic_config, record_frequency):
+        """
+        A topic is recorded if it published at all, its time interval passed and,
+        in on change mode, one of its values changed by more than the deadband
+        """
+        if self.data is None:
+            return False
 
-class Recorder:
-    def __init__(self):
-        self.model = rospy.get_param(os.path.join(rospy.get_namespace(), "model"), "")
+        if self.last_record_time is not None and (current_time - self.last_record_time) / 1e6 < topic_config.get("frequency", record_frequency):
+            return False
 
-        self.dir = rospkg.RosPack().get_path("arena-evaluation")
-        self.result_dir = os.path.join(self.dir, "data", datetime.now().strftime("%d-%m-%Y_%H-%M-%S")) + "_" + rospy.get_namespace().replace("/", "")
+        values = self.get_values()
+
+        if topic_config.get("on_change", False) and not self.has_changed(values, topic_config.get("deadband", 0)):
+            return False
+
+        self.last_record_time = current_time
+        self.last_recorded_values = values
+
+        return True
+
+    def get_values(self):
+        if isinstance(self.data, dict):
+            return np.concatenate([self.data["position"], self.data["velocity"]])
+
+        return np.array(self.data)
+
+    def has_changed(self, values, deadband):
+        if self.last_recorded_values is None or len(values) != len(self.last_recorded_values):
+            return True
+
+        if len(values) <= 0:
+            return False
+
+        return np.abs(values - self.last_recorded_values).max() > deadband
+
+
+class NamespaceRecorder:
+    """
+    Records the topics of a single robot namespace into its own result directory.
+    The sampling itself is triggered from the outside by the Recorder, which
+    owns the clock subscription and is shared between all namespaces.
+    """
+    ## Whether the files of an existing result directory may be overwritten
+    REUSE_RESULT_DIR = True
+
+    def __init__(self, dir, namespace, published_topics, timestamp, segment_episodes=False):
+        self.namespace = namespace
+        self.model = self.get_param("model", "")
+
+        self.result_dir = os.path.join(dir, "data", timestamp) + "_" + self.namespace.replace("/", "")
+
+        ## In segment mode the files of every episode are written into an own directory
+        self.segment_episodes = segment_episodes
+        self.segment = None
+        self.output_dir = self.result_dir
+
+        if not self.REUSE_RESULT_DIR and os.path.exists(self.result_dir):
+            raise FileExistsError(f"Result directory {self.result_dir} already exists")
 
         try:
             os.mkdir(self.result_dir)
         except:
             pass
-        
-        self.write_params()
 
-        topics_to_monitor = self.get_topics_to_monitor()
+        self.files = {}
+        self.writers = {}
+        self.last_episode = None
+        self.steps = 0
 
-        topics = rostopic.get_topic_list()
-        published_topics = topics[0]
+        self.write_params()
+
+        topics_to_monitor = Recorder.get_topics_to_monitor()
 
-        topic_matcher = re.compile(f"{rospy.get_namespace()}({'|'.join([t[0] for t in topics_to_monitor])})$")
+        topic_matcher = re.compile(f"{self.namespace}({'|'.join([t[0] for t in topics_to_monitor])})$")
 
         topics_to_sub = []
 
@@ -137,39 +197,236 @@ class Recorder:
 
             print(match, t, topic_matcher, match.group())
 
-            topics_to_sub.append([topic_name, *self.get_class_for_topic_name(topic_name)])
-
-            # topics_to_sub.append([topic_name, *[t for t in topics_to_monitor if t[0] == match.group()][0]])
+            topics_to_sub.append([topic_name, *Recorder.get_class_for_topic_name(topic_name)])
 
         self.data_collectors = []
+        self.headers = {}
 
         for topic in topics_to_sub:
-            self.data_collectors.append(DataCollector(topic))
-            self.write_data(
-                topic[1], [
-                    "time", "data"
-                ],
-                mode="w"
-            )
+            self.data_collectors.append(self.create_collector(topic))
+            self.headers[topic[1]] = ["time", "data"]
 
-        self.write_data("episode", ["time", "episode"], mode="w")
-        self.write_data("start_goal", ["episode", "start", "goal"], mode="w")
+        self.headers["episode"] = ["time", "episode"]
+        self.headers["start_goal"] = ["time", "episode", "start", "goal"]
 
-        self.current_episode = 0
+        if not self.segment_episodes:
+            self.write_headers()
+
+    def record(self, current_time, current_episode, config):
+        if self.segment_episodes and current_episode != self.last_episode:
+            self.start_segment(current_episode, current_time)
+
+        for collector in self.data_collectors:
+            topic_config = config.get("topics", {}).get(collector.full_topic_name, {})
+
+            if not collector.should_record(current_time, topic_config, config["record_frequency"]):
+                continue
+
+            topic_name, data = collector.get_data()
+            
+            self.write_data(topic_name, [current_time, data])
+        
+        self.steps += 1
+
+        if self.segment != None:
+            self.segment["end_time"] = current_time
+            self.segment["steps"] += 1
+
+        self.write_data("episode", [current_time, current_episode])
+        self.write_data("start_goal", [
+            current_time,
+            current_episode, 
+            self.get_param("start", [0, 0, 0]), 
+            self.get_param("goal", [0, 0, 0])
+        ])
+
+        ## Make the finished episode visible to readers of the files, e.g. get_metrics.py --watch
+        if current_episode != self.last_episode:
+            self.flush()
+
+            self.last_episode = current_episode
+
+    def start_segment(self, episode, current_time):
+        self.end_segment()
+
+        directory = f"episode_{episode:04d}"
+
+        self.output_dir = os.path.join(self.result_dir, directory)
+
+        os.makedirs(self.output_dir, exist_ok=True)
+
+        self.segment = {
+            "episode": episode,
+            "directory": directory,
+            "start_time": current_time,
+            "end_time": current_time,
+            "steps": 0
+        }
+
+        self.write_headers()
+
+        ## Every segment starts with the current values of all topics, thus it can be analyzed on its own
+        for collector in self.data_collectors:
+            collector.last_record_time = None
+            collector.last_recorded_values = None
+
+    def end_segment(self):
+        """
+        Closes the files of the current episode and adds it to the episode index
+        """
+        if self.segment == None:
+            return
+
+        self.close_files()
+
+        index_file = os.path.join(self.result_dir, "episode_index.csv")
+        is_new = not os.path.exists(index_file)
+
+        with open(index_file, "a", newline = "") as file:
+            writer = csv.writer(file, delimiter = ',')
+
+            if is_new:
+                writer.writerow(list(self.segment.keys()))
+
+            writer.writerow(list(self.segment.values()))
+
+        self.segment = None
+
+    def create_collector(self, topic):
+        return DataCollector(topic)
+
+    def get_param(self, name, *default):
+        """
+        Reads a parameter relative to the namespace, names starting with / are global
+        """
+        if not name.startswith("/"):
+            name = self.namespace + name
+
+        return rospy.get_param(name, *default)
+
+    def write_data(self, file_name, data, mode="a"):
+        if mode == "w" or file_name not in self.files:
+            if file_name in self.files:
+                self.files[file_name].close()
+
+            self.files[file_name] = open(f"{self.output_dir}/{file_name}.csv", mode, newline = "")
+            self.writers[file_name] = csv.writer(self.files[file_name], delimiter = ',')
+
+        self.writers[file_name].writerow(data)
+
+    def write_headers(self):
+        for file_name, header in self.headers.items():
+            self.write_data(file_name, header, mode="w")
+
+    def flush(self):
+        for file in self.files.values():
+            file.flush()
+
+    def close(self):
+        self.end_segment()
+        self.close_files()
+
+    def close_files(self):
+        for file in self.files.values():
+            file.close()
+
+        self.files = {}
+        self.writers = {}
+    
+    def write_completion(self, reason, episodes, elapsed_time):
+        """
+        Marks the recording as complete, e.g. for batch runners and get_metrics.py
+        """
+        with open(self.result_dir + "/done.yaml", "w") as file:
+            yaml.dump({
+                "reason": reason,
+                "episodes": episodes,
+                "time": round(elapsed_time, 3),
+                "steps": self.steps
+            }, file)
+
+    def write_params(self):
+        with open(self.result_dir + "/params.yaml", "w") as file:
+            yaml.dump({
+                "model": self.model,
+                "map_file": self.get_param("/map_file", ""),
+                "scenario_file": self.get_param("/scenario_file", ""),
+                "local_planner": self.get_param("local_planner"),
+                "agent_name": self.get_param("agent_name", ""),
+                "namespace": self.namespace.replace("/", "")
+            }, file)
+
+
+class Recorder:
+    """
+    Owns the /clock and /scenario_reset subscriptions and samples all
+    given robot namespaces from one shared loop.
+    """
+    def __init__(self, namespaces):
+        self.dir = rospkg.RosPack().get_path("arena-evaluation")
 
         self.config = self.read_config()
+        self.record_frequency = Recorder.get_record_frequency(self.config)
+
+        published_topics = rostopic.get_topic_list()[0]
+
+        timestamp = datetime.now().strftime("%d-%m-%Y_%H-%M-%S")
+
+        self.namespace_recorders = [
+            NamespaceRecorder(self.dir, namespace, published_topics, timestamp, self.config.get("segment_episodes", False)) 
+            for namespace in namespaces
+        ]
+
+        self.current_episode = 0
+
+        self.start_time = None
+        self.finished = False
+
+        ## close() runs in the shutdown thread, the files must not be written at the same time.
+        ## Reentrant, since a shutdown signaled from finish() may run close() in this thread
+        self.lock = RLock()
+
+        if self.config.get("on_finish", "shutdown") == "topic":
+            self.finish_publisher = rospy.Publisher(
+                self.config.get("finish_topic", "/data_recorder/finished"), 
+                String, 
+                queue_size=1, 
+                latch=True
+            )
 
         self.clock_sub = rospy.Subscriber("/clock", Clock, self.clock_callback)
         self.scenario_reset_sub = rospy.Subscriber("/scenario_reset", Int16, self.scenario_reset_callback)
 
         self.current_time = None
 
+        rospy.on_shutdown(self.close)
+
         print(rosparam.print_params("", "/"))
 
     def scenario_reset_callback(self, data: Int16):
-        self.current_episode = data.data
+        with self.lock:
+            self.current_episode = data.data
 
     def clock_callback(self, clock: Clock):
+        with self.lock:
+            if self.finished:
+                return
+
+            self.sample(clock)
+
+    def sample(self, clock: Clock):
+        ## Elapsed simulation time in seconds for max_time
+        clock_time = clock.clock.secs + clock.clock.nsecs / 1e9
+
+        if self.start_time is None:
+            self.start_time = clock_time
+
+        finish_reason = self.get_finish_reason(clock_time - self.start_time)
+
+        if finish_reason:
+            self.finish(finish_reason, clock_time - self.start_time)
+            return
+
         current_simulation_action_time = clock.clock.secs * 10e9 + clock.clock.nsecs
 
         if not self.current_time:
@@ -177,28 +434,103 @@ class Recorder:
 
         time_diff = (current_simulation_action_time - self.current_time) / 1e6 ## in ms
 
-        if time_diff < self.config["record_frequency"]:
+        if time_diff < self.record_frequency:
             return
 
         self.current_time = current_simulation_action_time
 
-        for collector in self.data_collectors:
-            topic_name, data = collector.get_data()
-            
-            self.write_data(topic_name, [self.current_time, data])
-        
-        self.write_data("episode", [self.current_time, self.current_episode])
-        self.write_data("start_goal", [
-            self.current_episode, 
-            rospy.get_param(rospy.get_namespace() + "start", [0, 0, 0]), 
-            rospy.get_param(rospy.get_namespace() + "goal", [0, 0, 0])
-        ])
+        for namespace_recorder in self.namespace_recorders:
+            namespace_recorder.record(self.current_time, self.current_episode, self.config)
+
+    def get_finish_reason(self, elapsed_time):
+        max_episodes = self.config.get("max_episodes", None)
+        max_time = self.config.get("max_time", None)
+
+        if max_episodes and self.current_episode >= max_episodes:
+            return "max_episodes"
+
+        if max_time and elapsed_time >= max_time:
+            return "max_time"
+
+        return None
+
+    def finish(self, reason, elapsed_time):
+        """
+        Closes all outputs, writes the completion markers and signals
+        that the run can be stopped
+        """
+        self.finished = True
+
+        for namespace_recorder in self.namespace_recorders:
+            namespace_recorder.close()
+            namespace_recorder.write_completion(reason, self.current_episode, elapsed_time)
+
+        print("Recording finished", reason, "after", self.current_episode, "episodes")
+
+        self.signal_finish(reason)
+
+    def signal_finish(self, reason):
+        on_finish = self.config.get("on_finish", "shutdown")
+
+        if on_finish == "shutdown":
+            rospy.signal_shutdown(f"Recording finished: {reason}")
+        elif on_finish == "topic":
+            self.finish_publisher.publish(String(reason))
+
+    def close(self):
+        with self.lock:
+            ## The files were already closed by finish()
+            if self.finished:
+                return
+
+            self.finished = True
+
+            for namespace_recorder in self.namespace_recorders:
+                namespace_recorder.close()
 
     def read_config(self):
         with open(self.dir + "/data_recorder_config.yaml") as file:
             return yaml.safe_load(file)
 
-    def get_class_for_topic_name(self, topic_name):
+    @staticmethod
+    def get_record_frequency(config):
+        """
+        Episode and start goal are recorded in every step, 
+        thus with the smallest interval of all topics
+        """
+        return min([
+            config["record_frequency"], 
+            *[topic.get("frequency", config["record_frequency"]) for topic in config.get("topics", {}).values()]
+        ])
+
+    @staticmethod
+    def discover_namespaces(published_topics=None, has_param=rospy.has_param):
+        """
+        Returns all namespaces which publish an odometry topic and
+        have a local planner set, e.g. ["/jackal_0/", "/jackal_1/"]
+        """
+        if published_topics == None:
+            published_topics = rostopic.get_topic_list()[0]
+
+        namespaces = []
+
+        for topic_name, *_ in published_topics:
+            match = re.match(r"^(/.+/)odom$", topic_name)
+
+            if not match:
+                continue
+
+            namespace = match.group(1)
+
+            if namespace in namespaces or not has_param(namespace + "local_planner"):
+                continue
+
+            namespaces.append(namespace)
+
+        return sorted(namespaces)
+
+    @staticmethod
+    def get_class_for_topic_name(topic_name):
         if "/scan" in topic_name:
             return ["scan", LaserScan]
         if "/odom" in topic_name:
@@ -206,7 +538,8 @@ class Recorder:
         if "/cmd_vel" in topic_name:
             return ["cmd_vel", Twist]
 
-    def get_topics_to_monitor(self):
+    @staticmethod
+    def get_topics_to_monitor():
         return [
             ("scan", LaserScan),
             ("scenario_reset", Int16),
@@ -214,30 +547,20 @@ class Recorder:
             ("cmd_vel", Twist)
         ]
 
-    def write_data(self, file_name, data, mode="a"):
-        with open(f"{self.result_dir}/{file_name}.csv", mode, newline = "") as file:
-            writer = csv.writer(file, delimiter = ',')
-            writer.writerow(data)
-            file.close()
-    
-    def write_params(self):
-        with open(self.result_dir + "/params.yaml", "w") as file:
-            yaml.dump({
-                "model": self.model,
-                "map_file": rospy.get_param("/map_file", ""),
-                "scenario_file": rospy.get_param("/scenario_file", ""),
-                "local_planner": rospy.get_param(rospy.get_namespace() + "local_planner"),
-                "agent_name": rospy.get_param(rospy.get_namespace() + "agent_name", ""),
-                "namespace": rospy.get_namespace().replace("/", "")
-            }, file)
-
 
 if __name__=="__main__":
     rospy.init_node("data_recorder", anonymous=True) 
 
     time.sleep(5)   
 
-    Recorder()
+    ## Record all robot namespaces from a single process instead of one node per robot
+    if rospy.get_param("~all_namespaces", False):
+        namespaces = Recorder.discover_namespaces()
+    else:
+        namespaces = [rospy.get_namespace()]
 
-    rospy.spin()
+    print("Recording namespaces", namespaces)
 
+    Recorder(namespaces)
+
+    rospy.spin()
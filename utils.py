@@ -1,4 +1,26 @@
-import numpy as np
+import importlib
+
+
+class LazyModule:
+    """
+    Imports the module on the first attribute access, so scripts only
+    pay the import time of heavy packages they actually use.
+    """
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attribute):
+        if attribute in ("_name", "_module"):
+            raise AttributeError(attribute)
+
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+
+        return getattr(self._module, attribute)
+
+
+np = LazyModule("numpy")
 
 
 class Utils:
@@ -0,0 +1,274 @@
+"""
+Work queue over the run directories in ./data for several evaluation workers.
+
+The workers only need a shared filesystem. A run is claimed by atomically
+creating a lock file in its directory, which the owning worker touches
+periodically. Locks which were not touched for longer than the lock timeout
+belong to crashed workers and are taken over. Processed runs are marked with
+a done file, runs whose evaluation failed with a failed file. Runs are only
+claimed once the recorder wrote its done.yaml. Runs without it, e.g. older or
+aborted recordings, are optionally claimed once none of their files changed
+for longer than the lock timeout.
+"""
+import os
+import json
+import random
+import socket
+import threading
+import traceback
+import uuid
+from time import sleep, time
+
+import yaml
+
+
+LOCK_FILE = "metrics.lock"
+DONE_FILE = "metrics_done.yaml"
+FAILED_FILE = "metrics_failed.yaml"
+
+## Written by the recorder after all files of the run are closed
+RECORDING_DONE_FILE = "done.yaml"
+
+
+class RunLock:
+    """
+    Lock of a single run directory, kept alive by a heartbeat thread
+    """
+    def __init__(self, dir, lock_timeout, heartbeat_interval):
+        self.path = os.path.join(dir, LOCK_FILE)
+        self.lock_timeout = lock_timeout
+        self.heartbeat_interval = heartbeat_interval
+
+        self.token = uuid.uuid4().hex
+        self.lost = False
+
+        self.stopped = threading.Event()
+        self.heartbeat = None
+
+    def acquire(self):
+        self.remove_if_stale()
+
+        try:
+            ## O_EXCL fails if another worker created the lock first
+            descriptor = os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return False
+
+        with os.fdopen(descriptor, "w") as file:
+            json.dump({"token": self.token, "host": socket.gethostname(), "pid": os.getpid(), "time": time()}, file)
+
+        self.heartbeat = threading.Thread(target=self.keep_alive, daemon=True)
+        self.heartbeat.start()
+
+        return True
+
+    def release(self):
+        self.stopped.set()
+
+        if self.heartbeat != None:
+            self.heartbeat.join()
+
+        if self.is_owner():
+            os.remove(self.path)
+
+    def keep_alive(self):
+        while not self.stopped.wait(self.heartbeat_interval):
+            if not self.is_owner():
+                print("Lock", self.path, "was taken over by another worker")
+                self.lost = True
+                return
+
+            os.utime(self.path)
+
+    def is_owner(self):
+        return RunLock.read_token(self.path) == self.token
+
+    def remove_if_stale(self):
+        """
+        Moves a stale lock aside. Renaming is atomic, thus only one of several
+        workers finding the same stale lock removes it.
+        """
+        if not RunLock.is_stale(self.path, self.lock_timeout):
+            return
+
+        stale_path = f"{self.path}.stale.{self.token}"
+
+        try:
+            os.rename(self.path, stale_path)
+        except FileNotFoundError:
+            return
+
+        ## Another worker replaced the stale lock in between, the live lock is restored
+        if not RunLock.is_stale(stale_path, self.lock_timeout):
+            try:
+                os.link(stale_path, self.path)
+            except FileExistsError:
+                pass
+
+        os.remove(stale_path)
+
+    @staticmethod
+    def is_stale(path, lock_timeout):
+        try:
+            return time() - os.path.getmtime(path) > lock_timeout
+        except FileNotFoundError:
+            return False
+
+    @staticmethod
+    def read_token(path):
+        try:
+            with open(path) as file:
+                return json.load(file).get("token", None)
+        except (FileNotFoundError, ValueError):
+            return None
+
+
+class WorkQueue:
+    def __init__(self, data_dir="data", lock_timeout=300, heartbeat_interval=30, poll_interval=10, retry_failed=False, include_unmarked=False):
+        assert heartbeat_interval < lock_timeout, "The heartbeat interval has to be shorter than the lock timeout"
+
+        self.data_dir = data_dir
+        self.lock_timeout = lock_timeout
+        self.heartbeat_interval = heartbeat_interval
+        self.poll_interval = poll_interval
+        self.retry_failed = retry_failed
+        self.include_unmarked = include_unmarked
+
+        self.processed = []
+        self.failed = []
+
+    def get_pending_runs(self):
+        """
+        Returns all finished recordings which are neither done nor failed
+        """
+        pending = []
+
+        for run in sorted(os.listdir(self.data_dir)):
+            dir = os.path.join(self.data_dir, run)
+
+            if not os.path.exists(os.path.join(dir, "params.yaml")):
+                continue
+
+            if not os.path.exists(os.path.join(dir, "episode.csv")) and not os.path.exists(os.path.join(dir, "episode_index.csv")):
+                continue
+
+            if not self.is_recording_finished(dir):
+                continue
+
+            if os.path.exists(os.path.join(dir, DONE_FILE)):
+                continue
+
+            if not self.retry_failed and os.path.exists(os.path.join(dir, FAILED_FILE)):
+                continue
+
+            pending.append(dir)
+
+        return pending
+
+    def is_recording_finished(self, dir):
+        """
+        A run is finished once the recorder wrote its done.yaml. Runs without
+        it are only finished if unmarked runs are included and none of their
+        files changed within the lock timeout.
+        """
+        if os.path.exists(os.path.join(dir, RECORDING_DONE_FILE)):
+            return True
+
+        if not self.include_unmarked:
+            return False
+
+        ## Files of the workers do not belong to the recording
+        recorded = [name for name in os.listdir(dir) if not name.startswith((LOCK_FILE, FAILED_FILE))]
+
+        last_change = max(os.path.getmtime(os.path.join(dir, name)) for name in recorded)
+
+        return time() - last_change > self.lock_timeout
+
+    def run(self, process, max_runs=None):
+        """
+        Claims and processes pending runs until none are left. Runs locked
+        by other workers are polled, since their lock may become stale.
+
+        Returns the processed run directories
+        """
+        while max_runs == None or len(self.processed) + len(self.failed) < max_runs:
+            pending = self.get_pending_runs()
+
+            if len(pending) == 0:
+                break
+
+            ## Workers start at different runs to avoid contention on the same locks
+            random.shuffle(pending)
+
+            claimed = False
+
+            for dir in pending:
+                if self.process_run(dir, process):
+                    claimed = True
+                    break
+
+            if not claimed:
+                print("Remaining", len(pending), "runs are locked by other workers, waiting")
+                sleep(self.poll_interval)
+
+        print("Worker processed", len(self.processed), "runs,", len(self.failed), "failed")
+
+        return self.processed
+
+    def process_run(self, dir, process):
+        lock = RunLock(dir, self.lock_timeout, self.heartbeat_interval)
+
+        if not lock.acquire():
+            return False
+
+        try:
+            ## The run may have been finished while the pending runs were listed
+            if os.path.exists(os.path.join(dir, DONE_FILE)):
+                return True
+
+            print("Processing", dir)
+
+            start_time = time()
+
+            try:
+                process(dir)
+            except Exception as e:
+                traceback.print_exc()
+
+                self.failed.append(dir)
+
+                WorkQueue.write_marker(os.path.join(dir, FAILED_FILE), {
+                    "host": socket.gethostname(),
+                    "error": repr(e),
+                    "time": start_time
+                })
+
+                return True
+
+            ## The worker taking over the lock writes the done file
+            if lock.lost:
+                return True
+
+            self.processed.append(dir)
+
+            WorkQueue.write_marker(os.path.join(dir, DONE_FILE), {
+                "host": socket.gethostname(),
+                "time": start_time,
+                "duration": round(time() - start_time, 3)
+            })
+
+            if os.path.exists(os.path.join(dir, FAILED_FILE)):
+                os.remove(os.path.join(dir, FAILED_FILE))
+        finally:
+            lock.release()
+
+        return True
+
+    @staticmethod
+    def write_marker(path, content):
+        temporary_file = f"{path}.{uuid.uuid4().hex}"
+
+        with open(temporary_file, "w") as file:
+            yaml.dump(content, file)
+
+        os.replace(temporary_file, path)